@@ -0,0 +1,77 @@
+# Day ahead market price ingestion
+# Reads DAM csv exports (single days or multi-year files) in chunks,
+# parses 'interval_start_utc' with an explicit format and converts it to
+# the market's local time (DST aware) instead of a fixed -7 hour shift,
+# and yields one DataFrame per local day.
+#
+# The local times stay in the 'interval_start_utc' column, as the
+# schedulers have always used that column for local time.
+
+import pandas as pd
+
+MARKET_TZ = 'America/Los_Angeles'       # CAISO
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S%z'     # e.g. 2024-10-10 07:00:00+00:00
+CHUNK_ROWS = 200000
+
+def parse_utc(values):
+    """
+    Parse UTC timestamps with the explicit format, falling back to ISO 8601 variants
+    """
+    try:
+        return pd.to_datetime(values, format=TIME_FORMAT, utc=True)
+    except ValueError:
+        return pd.to_datetime(values, format='ISO8601', utc=True)
+
+def floor_hour(times):
+    """
+    Floor local times to the hour; tz-aware times are floored in UTC so the
+    repeated hour of the fall-back day is not ambiguous
+    """
+    if times.dt.tz is None:
+        return times.dt.floor('h')
+    return times.dt.tz_convert('UTC').dt.floor('h').dt.tz_convert(times.dt.tz)
+
+def iter_dam_days(path, tz=MARKET_TZ, chunksize=CHUNK_ROWS, location=None):
+    """
+    Yield (date, DataFrame[interval_start_utc, lmp]) per local day, reading the file in chunks
+    """
+    usecols = ['interval_start_utc', 'lmp'] + (['location'] if location else [])
+    carry = None
+    for chunk in pd.read_csv(path, usecols=usecols, chunksize=chunksize):
+        if location:
+            chunk = chunk[chunk['location'] == location].drop(columns='location')
+        chunk = chunk.copy()
+        chunk['interval_start_utc'] = parse_utc(chunk['interval_start_utc']).dt.tz_convert(tz)
+        chunk['lmp'] = pd.to_numeric(chunk['lmp'], errors='coerce')
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if chunk.empty:
+            continue
+
+        dates = chunk['interval_start_utc'].dt.date
+        last_date = dates.iloc[-1]
+        # The last day may continue in the next chunk
+        carry = chunk[dates == last_date]
+        done = chunk[dates != last_date]
+        for date, day_df in done.groupby(dates[dates != last_date], sort=True):
+            yield date, day_df.sort_values('interval_start_utc').reset_index(drop=True)
+
+    if carry is not None and not carry.empty:
+        yield carry['interval_start_utc'].iloc[0].date(), carry.sort_values('interval_start_utc').reset_index(drop=True)
+
+def iter_dam_arrays(path, tz=MARKET_TZ, chunksize=CHUNK_ROWS, location=None):
+    """
+    Same as iter_dam_days, as (date, local times, lmp) NumPy arrays
+    """
+    for date, df in iter_dam_days(path, tz, chunksize, location):
+        times = df['interval_start_utc'].dt.tz_localize(None).to_numpy().astype('datetime64[ns]')
+        yield date, times, df['lmp'].to_numpy()
+
+def load_dam_day(path, tz=MARKET_TZ):
+    """
+    Whole file as one DataFrame (for single day files)
+    """
+    days = [df for _, df in iter_dam_days(path, tz)]
+    if not days:
+        return pd.DataFrame(columns=['interval_start_utc', 'lmp'])
+    return pd.concat(days, ignore_index=True)
@@ -1,112 +1,313 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from numpy.random import normal
 from numpy import zeros, savetxt, loadtxt
 import random
-import RPi.GPIO as GPIO
-from time import time, sleep
-from threading import Thread
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 import os
-import csv
-#Initialize GPIO
-GPIO.setwarnings(False)
-GPIO.setmode(GPIO.BCM)
-FMPIN = 6    #flow meter GPIO pin
-VPIN = 17    #valve GPIO pin
-GPIO.setup(FMPIN, GPIO.IN, GPIO.PUD_UP) #setup flow meter pin as input
-GPIO.setup(VPIN, GPIO.OUT, initial=GPIO.LOW)    #setup valve pin as output
-GPIO.add_event_detect(FMPIN, GPIO.RISING)   #add rising edge detection
+import sys
+import json
+from collections import deque
+from WH_clock import WallClock
+from WH_metrics import counter, histogram, start_metrics
+from WH_aggregator import DrawSummary
+from Schedule_compile import load_draw_schedule, ScheduleError
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None     # not on a Pi; WH_simulation.py provides a stand-in
+
+# Pin map: one entry per valve/flow meter pair (test rig).
+# 'name' is added to the log file name when more than one rig is configured,
+# e.g. WH_Data_WH2_M-D-YYYY.csv. A single rig keeps WH_Data_M-D-YYYY.csv.
+RIGS = [
+    {'name': 'WH1', 'fm_pin': 6, 'valve_pin': 17, 'schedule': '12H-WDP.csv'},
+    #{'name': 'WH2', 'fm_pin': 5, 'valve_pin': 27, 'schedule': '12H-WDP.csv'},
+    #{'name': 'WH3', 'fm_pin': 13, 'valve_pin': 22, 'schedule': '12H-WDP.csv'},
+    #{'name': 'WH4', 'fm_pin': 19, 'valve_pin': 23, 'schedule': '12H-WDP.csv'},
+]
+
+PULSES_PER_GAL = 476    # flow meter pulses per gallon (default until a rig is calibrated)
+DRAW_TIMEOUT = 180      # seconds
+
+# Valve control: 'threshold' closes the valve once the target volume has
+# passed; 'predictive' estimates the flow rate from the last FLOW_WINDOW
+# seconds of pulses and closes early by the rig's closing lag, which is
+# learned from the pulses counted after each close and saved with the
+# rig's pulses per gallon in DrawCal_<name>.json (see calibrate()).
+CONTROL_MODE = 'threshold'
+FLOW_WINDOW = 0.5       # seconds
+SETTLE_TIME = 1.0       # seconds to count pulses after the valve closes
+DEFAULT_CLOSE_LAG = 0.2     # seconds
+LAG_LEARNING_RATE = 0.3     # weight of the newest draw in the learned closing lag
+
+# Time source; WH_simulation.py replaces it with a virtual clock
+clock = WallClock()
+
+# Opt-in telemetry (see WH_metrics.py): a port for the /metrics endpoint
+# and/or a JSON file rewritten every 30 seconds
+METRICS_PORT = None
+METRICS_JSON = None
+
+# Per-minute/per-hour draw summaries (see WH_aggregator.py), written to
+# <prefix>_minute.csv and <prefix>_hour.csv (<prefix>_<name>_... with
+# several rigs); None to turn off
+SUMMARY_PREFIX = 'WH_Draw_summary'
+
+draws_started = counter('draw_started_total', 'Draws started')
+draws_late = counter('draw_late_total', 'Draws that had to wait for the previous draw on the rig')
+draw_timeouts = counter('draw_timeout_total', 'Draws stopped by the timeout')
+draw_start_latency = histogram('draw_start_latency_seconds', 'Delay from the scheduled second to opening the valve')
+draw_volume_error = histogram('draw_volume_error_gal', 'Volume drawn minus target volume',
+                              buckets=[-0.5, -0.1, -0.05, -0.01, 0, 0.01, 0.05, 0.1, 0.5, 1])
+
+# Per-channel pulse counters, incremented from the GPIO edge callbacks
+pulse_counts = {}
+pulse_lock = Lock()
+
+def count_pulse(channel):
+    with pulse_lock:
+        pulse_counts[channel] += 1
+
+def read_pulses(channel):
+    with pulse_lock:
+        return pulse_counts[channel]
+
+def setup_gpio():
+    #Initialize GPIO
+    GPIO.setwarnings(False)
+    GPIO.setmode(GPIO.BCM)
+
+def setup_rig(rig):
+    GPIO.setup(rig['fm_pin'], GPIO.IN, GPIO.PUD_UP)    #setup flow meter pin as input
+    GPIO.setup(rig['valve_pin'], GPIO.OUT, initial=GPIO.LOW)    #setup valve pin as output
+    pulse_counts[rig['fm_pin']] = 0
+    GPIO.add_event_detect(rig['fm_pin'], GPIO.RISING, callback=count_pulse)   #count rising edges
+    rig['lock'] = Lock()    # one draw at a time per rig
+    rig['cal'] = load_calibration(rig)
+
+def calibration_file(rig):
+    return 'DrawCal_' + rig['name'] + '.json'
+
+def load_calibration(rig):
+    """
+    Pulses per gallon and closing lag of the rig, defaults if it was never calibrated
+    """
+    cal = {'pulses_per_gal': PULSES_PER_GAL, 'close_lag': DEFAULT_CLOSE_LAG, 'draws': 0}
+    try:
+        with open(calibration_file(rig), 'r') as f:
+            cal.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except ValueError as e:
+        print(f"{rig['name']}: Error reading calibration, using defaults: {e}")
+    return cal
+
+def save_calibration(rig):
+    path = calibration_file(rig)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(rig['cal'], f, indent=2)
+    os.replace(tmp_path, path)
+
+def read_draw_schedule(schedule_file):
+    """
+    Read a two-column draw schedule (time, volume) into a {HH:MM:SS: volume} lookup,
+    through its compiled timeline (see Schedule_compile.py)
+    """
+    try:
+        timeline = load_draw_schedule(schedule_file)
+    except ScheduleError as e:
+        print(f"Error: invalid draw schedule {schedule_file}:")
+        for error in e.errors:
+            print(f"  {error}")
+        raise
+    return {'%02d:%02d:%02d' % (t // 3600, t % 3600 // 60, t % 60): volume for t, volume in timeline['draws']}
+
+def summary_prefix(rig):
+    if len(RIGS) == 1:
+        return SUMMARY_PREFIX
+    return SUMMARY_PREFIX + '_' + rig['name']
+
+def log_filename(rig, now):
+    date_str = str(now.month) + '-' + str(now.day) + '-' + str(now.year)
+    if len(RIGS) == 1:
+        return 'WH_Data_' + date_str + '.csv'
+    return 'WH_Data_' + rig['name'] + '_' + date_str + '.csv'
 
 #Define function to draw water
-def draw_water(targetVol):
+def draw_water(rig, targetVol):
     if targetVol <= 0:
         return (0, 0)  # Return volume and duration as 0 if target is invalid
-    
-    print('Drawing %.2f gallon(s).' % targetVol)
-    volume = 0
+
+    fm_pin = rig['fm_pin']
+    valve_pin = rig['valve_pin']
+    cal = rig['cal']
+    predictive = CONTROL_MODE == 'predictive'
+    print('%s: Drawing %.2f gallon(s).' % (rig['name'], targetVol))
+    target_pulses = targetVol * cal['pulses_per_gal']
     numPulses = 0
-    start_time = time()  # Record start time
-    
-    GPIO.output(VPIN, GPIO.HIGH)    #open valve
-    while volume < targetVol:  #keep valve open until desired volume has passed
-        if GPIO.event_detected(FMPIN):
-            numPulses += 1    #Count pulses from flow meter
-            volume = float(numPulses) / 476    #Calculate volume
-        
-        current_time = time()
-        elapsed_time = current_time - start_time
-        if elapsed_time > 180:
-            print('Timeout Error.')
+    rate = 0    # pulses per second over the last FLOW_WINDOW
+    samples = deque()
+    timed_out = False
+    start_pulses = read_pulses(fm_pin)
+    start_time = clock.time()  # Record start time
+
+    GPIO.output(valve_pin, GPIO.HIGH)    #open valve
+    while True:  #keep valve open until desired volume has passed (or will have passed once the valve closes)
+        numPulses = read_pulses(fm_pin) - start_pulses
+        now = clock.time()
+
+        predicted = numPulses
+        if predictive:
+            samples.append((now, numPulses))
+            while samples[0][0] < now - FLOW_WINDOW:
+                samples.popleft()
+            if now > samples[0][0]:
+                rate = (numPulses - samples[0][1]) / (now - samples[0][0])
+            predicted = numPulses + rate * cal['close_lag']
+        if predicted >= target_pulses:
+            break
+
+        elapsed_time = now - start_time
+        if elapsed_time > DRAW_TIMEOUT:
+            print('%s: Timeout Error.' % rig['name'])
+            draw_timeouts.inc(rig=rig['name'])
+            timed_out = True
             break
-    
-    GPIO.output(VPIN, GPIO.LOW) #close valve
-    end_time = time()  # Record end time
+        clock.sleep(0.001)
+
+    GPIO.output(valve_pin, GPIO.LOW) #close valve
+    end_time = clock.time()  # Record end time
     duration = round(end_time - start_time, 2)  # Calculate duration in seconds
-    
-    print('Volume drawn: %.2f gallon(s).' % volume)
-    print('Draw duration: %.2f seconds.' % duration)
-    
+
+    if predictive:
+        # Count the water that still passes while the valve closes and learn the lag
+        clock.sleep(SETTLE_TIME)
+        closePulses = numPulses
+        numPulses = read_pulses(fm_pin) - start_pulses
+        if rate > 0 and not timed_out:
+            measured_lag = (numPulses - closePulses) / rate
+            cal['close_lag'] = (1 - LAG_LEARNING_RATE) * cal['close_lag'] + LAG_LEARNING_RATE * measured_lag
+            cal['draws'] += 1
+            save_calibration(rig)
+    volume = float(numPulses) / cal['pulses_per_gal']    #Calculate volume
+
+    print('%s: Volume drawn: %.2f gallon(s).' % (rig['name'], volume))
+    print('%s: Draw duration: %.2f seconds.' % (rig['name'], duration))
+
     return (volume, duration)  # Return both volume and duration
 
-# Create a queue to store the results from the thread
-from queue import Queue
-result_queue = Queue()
-
-# Modified thread function to store results
-def draw_water_with_queue(targetVol, queue):
-    result = draw_water(targetVol)
-    queue.put(result)
-
-thread_draw = Thread(target=draw_water_with_queue, args=[0, result_queue])
-
-# Read schedule from gen4.csv
-times = []
-volumes = []
-with open('12H-WDP.csv', 'r') as file:
-    read = csv.reader(file)
-    for row in read:
-        times.append(row[0])
-        volumes.append(row[1])
-
-#Enter main program loop
-while True:
-    now = datetime.now()    #Update date/time
-    filename = 'WH_Data_' + str(now.month) + '-' + str(now.day) + '-' + str(now.year) + '.csv'
-    
-    # Create new file with header if it doesn't exist
-    if not os.path.isfile(filename):
-        with open(filename, 'w') as data:
-            data.write('Time,Draw Amount,Draw Duration\n')
-    
-    #Draw water if there is an event at this minute
+def run_draw(rig, targetVol, scheduled, filename):
+    timestr = datetime.strftime(scheduled, "%H:%M:%S")
+    with rig['lock']:
+        draw_start_latency.observe((clock.now() - scheduled).total_seconds(), rig=rig['name'])
+        draws_started.inc(rig=rig['name'])
+        actual_volume, duration = draw_water(rig, targetVol)
+    draw_volume_error.observe(actual_volume - targetVol, rig=rig['name'])
+
+    # Log the event with duration
+    try:
+        with open(filename, 'a') as data:
+            data.write(f"{timestr},{actual_volume:.2f},{duration:.2f}\n")
+        print(f"{rig['name']}: Logged: Time={timestr}, Volume={actual_volume:.2f}, Duration={duration:.2f}")
+    except IOError as e:
+        print(f"{rig['name']}: Error logging data: {e}")
+    if rig.get('summary') is not None:
+        rig['summary'].add_draw(scheduled, actual_volume, duration, targetVol)
+
+def check_draws(now):
     timestr = datetime.strftime(now, "%H:%M:%S")
-    drawVolume = 0
-    for i in range(0, len(times)):
-        if times[i] == timestr:
-            drawVolume = float(volumes[i])
-            
-    if drawVolume != 0:
-        if thread_draw.is_alive():
-            print('Debugging: Previous draw is still running. Waiting for draw to finish.\n')
-            thread_draw.join()
-            if not result_queue.empty():
-                thread_result = result_queue.get()
-        
-        # Start new thread with queue
-        result_queue = Queue()  # Reset queue for new thread
-        thread_draw = Thread(target=draw_water_with_queue, args=[drawVolume, result_queue])
-        thread_draw.start()
-        
-        # Wait for the draw to complete to get accurate duration
-        thread_draw.join()
-        actual_volume, duration = result_queue.get()
-        
-        # Log the event with duration - simplified direct write
-        try:
-            with open(filename, 'a') as data:
-                data.write(f"{timestr},{actual_volume:.2f},{duration:.2f}\n")
-            print(f"Logged: Time={timestr}, Volume={actual_volume:.2f}, Duration={duration:.2f}")
-        except IOError as e:
-            print(f"Error logging data: {e}")
-    
-    sleep(1)
+    for rig in RIGS:
+        filename = log_filename(rig, now)
+
+        # Create new file with header if it doesn't exist
+        if not os.path.isfile(filename):
+            with open(filename, 'w') as data:
+                data.write('Time,Draw Amount,Draw Duration\n')
+
+        #Draw water if there is an event at this second
+        drawVolume = rig['draws'].get(timestr, 0)
+        if drawVolume != 0:
+            if rig['lock'].locked():
+                print(f"Debugging: {rig['name']} previous draw is still running. Draw will start when it finishes.\n")
+                draws_late.inc(rig=rig['name'])
+            rig['pool'].submit(run_draw, rig, drawVolume, now, filename)
+
+def main(until=None, pool=None):
+    if METRICS_PORT or METRICS_JSON:
+        start_metrics(METRICS_PORT, METRICS_JSON)
+
+    setup_gpio()
+    for rig in RIGS:
+        setup_rig(rig)
+        rig['draws'] = read_draw_schedule(rig['schedule'])
+        rig['summary'] = DrawSummary(summary_prefix(rig)) if SUMMARY_PREFIX else None
+
+    # One single-worker queue per rig: draws on a rig run in order and never
+    # hold up draws on the other rigs. WH_simulation.py passes one inline pool.
+    for rig in RIGS:
+        rig['pool'] = pool if pool is not None else ThreadPoolExecutor(max_workers=1)
+    last_second = clock.now().replace(microsecond=0)
+
+    #Enter main program loop
+    try:
+        while until is None or clock.now() < until:
+            now = clock.now().replace(microsecond=0)    #Update date/time
+
+            # Check every second since the last pass, so a late wake-up or a
+            # slow pass never skips a scheduled draw
+            while last_second < now:
+                last_second += timedelta(seconds=1)
+                check_draws(last_second)
+            for rig in RIGS:
+                if rig['summary'] is not None:
+                    rig['summary'].tick(now)
+
+            # Wake up at the start of the next second
+            clock.sleep(1 - (clock.time() % 1))
+    finally:
+        # Finish the draw in progress but drop queued ones (e.g. after Ctrl-C)
+        for rig_pool in {id(rig['pool']): rig['pool'] for rig in RIGS}.values():
+            rig_pool.shutdown(wait=True, cancel_futures=True)
+        for rig in RIGS:
+            GPIO.output(rig['valve_pin'], GPIO.LOW)
+            if rig.get('summary') is not None:
+                rig['summary'].close()
+
+def calibrate():
+    """
+    Interactive pulses per gallon calibration: draw into a measuring container and enter the measured volume
+    """
+    setup_gpio()
+    try:
+        for rig in RIGS:
+            setup_rig(rig)
+            cal = rig['cal']
+            print(f"{rig['name']}: {cal['pulses_per_gal']:.1f} pulses/gal, closing lag {cal['close_lag']:.3f} s")
+            if input(f"Calibrate {rig['name']}? (y/n): ").lower() != 'y':
+                continue
+            targetVol = float(input("Volume to draw (gallons): "))
+            input("Place the measuring container under the outlet and press Enter...")
+
+            start_pulses = read_pulses(rig['fm_pin'])
+            draw_water(rig, targetVol)
+            clock.sleep(SETTLE_TIME)    # include the water that passes while the valve closes
+            pulses = read_pulses(rig['fm_pin']) - start_pulses
+
+            measured = float(input("Measured volume (gallons): "))
+            if measured <= 0 or pulses == 0:
+                print(f"{rig['name']}: Nothing measured, calibration not changed.")
+                continue
+            cal['pulses_per_gal'] = pulses / measured
+            save_calibration(rig)
+            print(f"{rig['name']}: Saved {cal['pulses_per_gal']:.1f} pulses/gal to {calibration_file(rig)}")
+    finally:
+        for rig in RIGS:
+            GPIO.output(rig['valve_pin'], GPIO.LOW)
 
+if __name__ == "__main__":
+    if '--calibrate' in sys.argv[1:]:
+        calibrate()
+    else:
+        main()
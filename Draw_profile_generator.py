@@ -0,0 +1,148 @@
+# Stochastic water draw profiles
+# Generates draw schedules for many household-days at once: the number of
+# draws in each hour is Poisson with the rate in HOURLY_RATE, each draw
+# belongs to one of the VOLUME_CLUSTERS (sink, appliance, shower, ...) and
+# each household gets its own usage scale. Draws on the same profile are
+# pushed apart so a draw never starts before the previous one has finished
+# plus MIN_GAP_SECONDS. A draw longer than DrawController_FM.py's
+# DRAW_TIMEOUT at FLOW_GPM (a long shower) is split into consecutive draws
+# of at most MAX_DRAW_GAL, keeping its total volume. MAX_DRAW_GAL keeps
+# TIMEOUT_MARGIN of the timeout (4.8 gal, 144 s at 2 gpm) so a rig flowing
+# up to 20% slower still finishes its draws. The same --seed gives
+# the same profiles.
+#
+# Each profile is written in the two-column format DrawController_FM.py
+# reads (Time,Values with HH:MM:SS times and gallons), e.g.
+#   python Draw_profile_generator.py --households 100 --days 30 --seed 1 --out-dir Draw_profiles
+# writes Draw_profiles/WDP_H001_D01.csv ... WDP_H100_D30.csv
+
+import argparse
+import os
+
+import numpy as np
+
+# Expected number of draws in each hour of the day
+HOURLY_RATE = np.array([0.1, 0.05, 0.05, 0.05, 0.1, 0.5, 2.0, 3.0, 2.5, 1.5,
+                        1.0, 1.0, 1.0, 0.8, 0.8, 0.8, 1.0, 1.5, 2.5, 2.5,
+                        2.0, 1.5, 0.8, 0.3])
+
+# Draw volume clusters: (share of draws, mean gallons, std gallons)
+VOLUME_CLUSTERS = [
+    (0.60, 0.5, 0.2),     # sink / short draws
+    (0.25, 2.0, 0.6),     # appliances, filling
+    (0.15, 10.0, 3.0),    # showers / baths
+]
+MIN_VOLUME = 0.1        # gallons
+FLOW_GPM = 2.0          # flow rate used to estimate draw duration
+MIN_GAP_SECONDS = 30    # idle time between the end of a draw and the next one
+DRAW_TIMEOUT = 180      # seconds, longest draw DrawController_FM.py runs before giving up
+TIMEOUT_MARGIN = 0.8    # share of DRAW_TIMEOUT a draw may take, for rigs flowing below FLOW_GPM
+MAX_DRAW_GAL = DRAW_TIMEOUT * TIMEOUT_MARGIN * FLOW_GPM / 60
+HOUSEHOLD_SIGMA = 0.3   # spread of the per-household usage scale (lognormal)
+
+def space_draws(starts, durations, gap=MIN_GAP_SECONDS):
+    """
+    Push sorted draw start times apart so each starts after the previous draw ends plus gap.
+    starts/durations are (profiles, draws) arrays, padded with inf/0 after the last draw.
+
+    start'[i] = max(start[i], start'[i-1] + duration[i-1] + gap), which unrolls to
+    offset[i] + max over j <= i of (start[j] - offset[j]) with offset the running
+    sum of duration + gap, i.e. one np.maximum.accumulate per row.
+    """
+    step = durations + gap
+    offset = np.concatenate([np.zeros((starts.shape[0], 1)), np.cumsum(step, axis=1)[:, :-1]], axis=1)
+    return np.maximum.accumulate(starts - offset, axis=1) + offset
+
+def generate_profiles(households, days, seed=None, hourly_rate=HOURLY_RATE, clusters=VOLUME_CLUSTERS):
+    """
+    Draw profiles for households * days household-days.
+    Returns (times, volumes) as (profiles, max draws) arrays of seconds after midnight and
+    gallons, sorted by time and padded with nan; profile p is household p // days, day p % days.
+    """
+    rng = np.random.default_rng(seed)
+    n = households * days
+
+    scale = np.repeat(rng.lognormal(0, HOUSEHOLD_SIGMA, households), days)
+    counts = rng.poisson(hourly_rate[None, :] * scale[:, None])    # (profiles, 24)
+    per_profile = counts.sum(axis=1)
+    total = per_profile.sum()
+
+    # One entry per draw: its profile, its hour and a random second in the hour
+    profile = np.repeat(np.arange(n), per_profile)
+    hour = np.repeat(np.tile(np.arange(24), n), counts.ravel())
+    start = hour * 3600 + rng.uniform(0, 3600, total)
+
+    shares = np.array([c[0] for c in clusters])
+    cluster = rng.choice(len(clusters), size=total, p=shares / shares.sum())
+    means = np.array([c[1] for c in clusters])[cluster]
+    stds = np.array([c[2] for c in clusters])[cluster]
+    volume = np.maximum(rng.normal(means, stds), MIN_VOLUME)
+
+    # Split draws the draw controller would time out on into equal consecutive pieces;
+    # the pieces share a start time and are pushed apart by space_draws
+    pieces = np.ceil(volume / MAX_DRAW_GAL).astype(int)
+    profile = np.repeat(profile, pieces)
+    start = np.repeat(start, pieces)
+    volume = np.round(np.repeat(volume / pieces, pieces), 2)
+    per_profile = np.bincount(profile, minlength=n)
+    total = len(profile)
+
+    # Scatter into (profiles, max draws), sorted by time within each profile
+    order = np.lexsort((start, profile))
+    profile, start, volume = profile[order], start[order], volume[order]
+    first = np.concatenate([[0], np.cumsum(per_profile)[:-1]])
+    column = np.arange(total) - np.repeat(first, per_profile)
+    width = max(int(per_profile.max()) if n else 0, 1)
+
+    starts = np.full((n, width), np.inf)
+    volumes = np.full((n, width), np.nan)
+    durations = np.zeros((n, width))
+    starts[profile, column] = start
+    volumes[profile, column] = volume
+    durations[profile, column] = volume / FLOW_GPM * 60
+
+    times = np.floor(space_draws(starts, durations))
+    # Draws pushed past midnight are dropped
+    late = times >= 24 * 3600
+    times[late] = np.nan
+    volumes[late | np.isnan(times)] = np.nan
+    return times, volumes
+
+def format_time(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+def write_profile(filename, times, volumes):
+    """
+    Write one profile in the draw controller's two-column format
+    """
+    with open(filename, 'w') as f:
+        f.write('Time,Values\n')
+        for t, v in zip(times, volumes):
+            if not np.isnan(t):
+                f.write(f'{format_time(t)},{v:g}\n')
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate stochastic draw schedules for DrawController_FM.py')
+    parser.add_argument('--households', type=int, default=1)
+    parser.add_argument('--days', type=int, default=1)
+    parser.add_argument('--seed', type=int, help='random seed, for reproducible profiles')
+    parser.add_argument('--out-dir', default='Draw_profiles')
+    parser.add_argument('--prefix', default='WDP')
+    args = parser.parse_args()
+
+    times, volumes = generate_profiles(args.households, args.days, args.seed)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for p in range(len(times)):
+        household, day = divmod(p, args.days)
+        filename = os.path.join(args.out_dir, f'{args.prefix}_H{household + 1:03d}_D{day + 1:02d}.csv')
+        write_profile(filename, times[p], volumes[p])
+
+    draws = np.sum(~np.isnan(volumes), axis=1)
+    gallons = np.nansum(volumes, axis=1)
+    print(f"Generated {len(times)} profiles in {args.out_dir}: "
+          f"{draws.mean():.1f} draws and {gallons.mean():.1f} gallons per day on average")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+# Backtest of load-up/shed schedules
+# Replays the schedules of Testing_schedule.py (generated from each day's
+# DAM prices, or read from Schedule_YYYYMMDD.csv files) against historical
+# DAM prices, and optionally real-time prices, using a simple water heater
+# tank model. Every day is simulated twice, with its schedule and with the
+# baseline 'e' command all day, and the cost difference is reported,
+# including the value of the energy left in the tank at midnight against
+# the baseline. Days are simulated on their real length (23 or 25 hours on
+# DST change days).
+# Days are split across worker processes; each worker builds the schedules
+# of its days and simulates them together as NumPy arrays, one time step
+# at a time.
+#
+# Example:
+#   python Schedule_backtest.py DAM_2022_2024.csv --rt RT_2022_2024.csv --output backtest.csv
+
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from DAM_ingest import MARKET_TZ, iter_dam_days
+from Testing_schedule import compute_schedule
+from WH_analytics import read_schedule_periods
+
+STEP_MINUTES = 5
+STEPS_PER_DAY = 24 * 60 // STEP_MINUTES     # wall clock steps of the draw profile
+
+# Tank model: 50 gal tank heated from 55F to 125F, 4.5 kW element
+TANK_KWH = 50 * 8.34 * 70 / 3412        # stored energy at setpoint (kWh)
+ELEMENT_KW = 4.5
+STANDBY_LOSS_KW = 0.05
+KWH_PER_GAL = 8.34 * 70 / 3412          # energy drawn with each gallon of hot water
+DAILY_DRAW_GAL = 60
+
+# Typical share of the daily hot water use in each hour
+HOURLY_DRAW_FRACTION = np.array([0.010, 0.005, 0.005, 0.005, 0.010, 0.030, 0.080, 0.100, 0.080, 0.060,
+                                 0.050, 0.040, 0.040, 0.035, 0.030, 0.030, 0.040, 0.060, 0.080, 0.070,
+                                 0.060, 0.040, 0.025, 0.015])
+HOURLY_DRAW_FRACTION = HOURLY_DRAW_FRACTION / HOURLY_DRAW_FRACTION.sum()
+
+# Thermostat band per command as tank state of charge: (turn on below, turn off at)
+MODE_E, MODE_L, MODE_S = 0, 1, 2
+MODE_CODES = {'e': MODE_E, 'l': MODE_L, 's': MODE_S}
+MODE_BAND = {
+    MODE_E: (0.90, 1.00),
+    MODE_L: (1.10, 1.20),   # load-up heats above the normal setpoint (mixing valve)
+    MODE_S: (0.40, 0.50),   # shed only heats to protect a minimum of hot water
+}
+
+OUTPUT_FIELDS = ['date', 'schedule', 'hours', 'energy_kWh', 'baseline_energy_kWh', 'cost_dam', 'baseline_cost_dam',
+                 'storage_value_dam', 'savings_dam', 'cost_rt', 'baseline_cost_rt', 'storage_value_rt', 'savings_rt',
+                 'min_soc', 'end_soc', 'baseline_end_soc']
+
+def step_draws(draw_profile=None):
+    """
+    Hot water energy drawn in each time step (kWh), the same for every day
+    """
+    if draw_profile is None:
+        per_hour = HOURLY_DRAW_FRACTION * DAILY_DRAW_GAL * KWH_PER_GAL
+        return np.repeat(per_hour / (60 // STEP_MINUTES), 60 // STEP_MINUTES)
+
+    # Two-column draw schedule, as read by DrawController_FM.py (HH:MM:SS, gallons)
+    draws = np.zeros(STEPS_PER_DAY)
+    with open(draw_profile, 'r') as f:
+        for row in csv.reader(f):
+            try:
+                t = datetime.strptime(row[0], '%H:%M:%S')
+                draws[(t.hour * 60 + t.minute) // STEP_MINUTES] += float(row[1]) * KWH_PER_GAL
+            except (IndexError, ValueError):
+                continue    # header line
+    return draws
+
+def day_grid(date, tz=MARKET_TZ):
+    """
+    Start of every time step of the local day: 276/288/300 steps on 23/24/25 hour days
+    """
+    start = pd.Timestamp(date).tz_localize(tz)
+    end = (pd.Timestamp(date) + pd.Timedelta(days=1)).tz_localize(tz)
+    return pd.date_range(start, end, freq=f'{STEP_MINUTES}min', inclusive='left')
+
+def utc_ns(times):
+    """
+    Absolute times as naive UTC datetime64[ns], for comparisons across DST changes
+    """
+    return pd.DatetimeIndex(times).tz_convert('UTC').tz_localize(None).to_numpy().astype('datetime64[ns]')
+
+def to_absolute(t, tz=MARKET_TZ):
+    """
+    A schedule time as naive UTC; wall clock times without a zone are taken in the market zone
+    """
+    t = pd.Timestamp(t)
+    if t.tzinfo is None:
+        t = t.tz_localize(tz, ambiguous=False, nonexistent='shift_forward')
+    return np.datetime64(t.tz_convert('UTC').tz_localize(None), 'ns')
+
+def prices_on_grid(day_df, grid):
+    """
+    Price in effect at each time step
+    """
+    times = utc_ns(day_df['interval_start_utc'])
+    idx = np.clip(np.searchsorted(times, utc_ns(grid), side='right') - 1, 0, len(times) - 1)
+    return day_df['lmp'].to_numpy()[idx]
+
+def draws_on_grid(draws, grid):
+    """
+    Draw profile (by wall clock time) at each time step; the repeated fall-back hour repeats its draws
+    """
+    wall = grid.tz_localize(None)
+    return draws[(wall.hour * 60 + wall.minute) // STEP_MINUTES]
+
+def modes_on_grid(periods, grid):
+    """
+    Command in effect at each time step; like WH_testing, the earliest matching period wins
+    """
+    steps = utc_ns(grid)
+    modes = np.full(len(steps), MODE_E, dtype=np.int8)
+    for command, start, end in reversed(periods):
+        modes[(steps >= to_absolute(start)) & (steps < to_absolute(end))] = MODE_CODES[command]
+    return modes
+
+def generated_periods(day_df):
+    """
+    Schedule periods from Testing_schedule.compute_schedule for the day
+    """
+    result = compute_schedule(day_df)
+    periods = []
+    for key, command in [('morning_loadup', 'l'), ('morning_shed', 's'), ('evening_loadup', 'l'), ('evening_shed', 's')]:
+        for start, end, _ in result[key]:
+            periods.append((command, start, end))
+    return sorted(periods, key=lambda p: to_absolute(p[1]))
+
+def file_periods(schedule_dir, date):
+    """
+    Schedule periods from Schedule_YYYYMMDD.csv, None if the day has no schedule file
+    """
+    path = os.path.join(schedule_dir, f"Schedule_{date.strftime('%Y%m%d')}.csv")
+    if not os.path.isfile(path):
+        return None
+    df = read_schedule_periods(path, date)
+    return [(row.command, row.start, row.end) for row in df.itertuples()]
+
+def prepare_day(date, day_df, rt_df, draws, schedule_dir):
+    """
+    Schedule, prices and draws of one day on its time step grid
+    """
+    grid = day_grid(date)
+    try:
+        if schedule_dir:
+            periods = file_periods(schedule_dir, date)
+            label = 'file' if periods is not None else 'none'
+            periods = periods or []
+        else:
+            periods = generated_periods(day_df)
+            label = 'generated'
+    except Exception as e:
+        # e.g. a partial first or last day of an export; the day runs as baseline
+        print(f"Warning: no schedule for {date} ({type(e).__name__}: {e}), simulated as baseline")
+        periods = []
+        label = 'failed'
+    rt = prices_on_grid(rt_df, grid) if rt_df is not None else None
+    return label, modes_on_grid(periods, grid), prices_on_grid(day_df, grid), rt, draws_on_grid(draws, grid)
+
+def simulate(modes, draws, valid, soc0=1.0):
+    """
+    Tank simulation for many days at once; modes, draws and valid are (days, steps),
+    with valid False on the padding after the last step of shorter days.
+    Returns power (kW) and state of charge.
+    """
+    days, steps = modes.shape
+    dt = STEP_MINUTES / 60
+    lower = np.array([MODE_BAND[m][0] for m in range(3)])
+    upper = np.array([MODE_BAND[m][1] for m in range(3)])
+
+    soc = np.full(days, soc0)
+    heating = np.zeros(days, dtype=bool)
+    power = np.zeros((days, steps))
+    soc_trace = np.zeros((days, steps))
+    for k in range(steps):
+        lo = lower[modes[:, k]]
+        hi = upper[modes[:, k]]
+        heating = ((soc < lo) | (heating & (soc < hi))) & valid[:, k]
+        # Do not heat past the upper limit within the step
+        room = np.maximum(hi - soc, 0) * TANK_KWH
+        energy_in = np.where(heating, np.minimum(ELEMENT_KW * dt, room), 0.0)
+        power[:, k] = energy_in / dt
+        soc = soc + (energy_in - draws[:, k] - STANDBY_LOSS_KW * dt * valid[:, k]) / TANK_KWH
+        soc_trace[:, k] = soc
+    return power, soc_trace
+
+def pad(arrays, width, fill=0):
+    out = np.full((len(arrays), width), fill, dtype=np.asarray(arrays[0]).dtype)
+    for i, a in enumerate(arrays):
+        out[i, :len(a)] = a
+    return out
+
+def backtest_chunk(chunk, draws, schedule_dir):
+    """
+    Schedule and simulate a chunk of days: [(date, dam day DataFrame, rt day DataFrame or None)]
+    """
+    days = [prepare_day(date, day_df, rt_df, draws, schedule_dir) for date, day_df, rt_df in chunk]
+    lengths = np.array([len(d[1]) for d in days])
+    width = lengths.max()
+    valid = np.arange(width)[None, :] < lengths[:, None]
+    modes = pad([d[1] for d in days], width)
+    dam = pad([d[2] for d in days], width)
+    day_draws = pad([d[4] for d in days], width)
+    dt = STEP_MINUTES / 60
+
+    power, soc = simulate(modes, day_draws, valid)
+    base_power, base_soc = simulate(np.zeros_like(modes), day_draws, valid)
+    end_soc = soc[np.arange(len(days)), lengths - 1]
+    base_end_soc = base_soc[np.arange(len(days)), lengths - 1]
+
+    energy = power.sum(axis=1) * dt
+    base_energy = base_power.sum(axis=1) * dt
+    cost_dam = (power * dam).sum(axis=1) * dt / 1000    # LMP is $/MWh
+    base_cost_dam = (base_power * dam).sum(axis=1) * dt / 1000
+    # Energy left in (or missing from) the tank at midnight against the baseline,
+    # valued at the day's average price: a shed running to midnight pays its recovery
+    stored_kwh = (end_soc - base_end_soc) * TANK_KWH
+    storage_dam = stored_kwh * (dam * valid).sum(axis=1) / lengths / 1000
+
+    rows = []
+    for i, ((date, _, _), (label, _, _, rt, _)) in enumerate(zip(chunk, days)):
+        row = {
+            'date': date.isoformat(),
+            'schedule': label,
+            'hours': round(lengths[i] * dt, 2),
+            'energy_kWh': round(energy[i], 3),
+            'baseline_energy_kWh': round(base_energy[i], 3),
+            'cost_dam': round(cost_dam[i], 4),
+            'baseline_cost_dam': round(base_cost_dam[i], 4),
+            'storage_value_dam': round(storage_dam[i], 4),
+            'savings_dam': round(base_cost_dam[i] - cost_dam[i] + storage_dam[i], 4),
+            'cost_rt': '', 'baseline_cost_rt': '', 'storage_value_rt': '', 'savings_rt': '',
+            'min_soc': round(soc[i, :lengths[i]].min(), 3),
+            'end_soc': round(end_soc[i], 3),
+            'baseline_end_soc': round(base_end_soc[i], 3),
+        }
+        if rt is not None:
+            n = lengths[i]
+            cost_rt = (power[i, :n] * rt).sum() * dt / 1000
+            base_cost_rt = (base_power[i, :n] * rt).sum() * dt / 1000
+            storage_rt = stored_kwh[i] * rt.mean() / 1000
+            row.update({'cost_rt': round(cost_rt, 4), 'baseline_cost_rt': round(base_cost_rt, 4),
+                        'storage_value_rt': round(storage_rt, 4),
+                        'savings_rt': round(base_cost_rt - cost_rt + storage_rt, 4)})
+        rows.append(row)
+    return rows
+
+def load_rt_prices(paths):
+    rt = {}
+    for path in paths or []:
+        for date, df in iter_dam_days(path):
+            rt[date] = df
+    return rt
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest load-up/shed schedules against historical prices')
+    parser.add_argument('files', nargs='+', help='DAM csv files (single or multi-day exports)')
+    parser.add_argument('--schedules', help='folder with Schedule_YYYYMMDD.csv (default: generate from the prices)')
+    parser.add_argument('--rt', action='append', help='real-time price csv, same layout as the DAM files')
+    parser.add_argument('--draw-profile', help='two-column draw schedule (HH:MM:SS, gallons) used every day')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-days', type=int, default=64)
+    parser.add_argument('--output', default='Schedule_backtest.csv')
+    args = parser.parse_args()
+
+    draws = step_draws(args.draw_profile)
+    rt = load_rt_prices(args.rt)
+
+    # Scheduling and simulation both run in the workers; the parent only reads the prices
+    chunks = [[]]
+    for path in args.files:
+        for date, df in iter_dam_days(path):
+            chunks[-1].append((date, df, rt.get(date)))
+            if len(chunks[-1]) == args.chunk_days:
+                chunks.append([])
+    chunks = [c for c in chunks if c]
+
+    total_days = sum(len(c) for c in chunks)
+    print(f"Backtesting {total_days} days with {args.workers} workers...")
+
+    savings = []
+    failed = 0
+    with open(args.output, 'w', newline='') as out, ProcessPoolExecutor(max_workers=args.workers) as pool:
+        writer = csv.DictWriter(out, fieldnames=OUTPUT_FIELDS)
+        writer.writeheader()
+        futures = [pool.submit(backtest_chunk, chunk, draws, args.schedules) for chunk in chunks]
+        for future in futures:
+            rows = future.result()
+            writer.writerows(rows)
+            savings.extend(row['savings_dam'] for row in rows)
+            failed += sum(row['schedule'] == 'failed' for row in rows)
+
+    if savings:
+        savings = np.array(savings)
+        print(f"Total DAM savings: ${savings.sum():.2f} over {len(savings)} days "
+              f"(mean ${savings.mean():.3f}/day, saving on {np.mean(savings > 0) * 100:.0f}% of days)")
+    if failed:
+        print(f"{failed} days could not be scheduled and were simulated as baseline")
+    print(f"Backtest results saved as: {args.output}")
+
+if __name__ == "__main__":
+    main()
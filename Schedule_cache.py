@@ -0,0 +1,101 @@
+# Content-addressed cache of schedule results
+# A result is stored under the hash of the day's price data plus every
+# scheduling parameter, so rerunning Testing_schedule.py on the same days
+# with the same parameters reuses the stored peaks, periods and schedule.
+# The cache folder is bounded in size; the least recently used results
+# are evicted first. The folder size is counted once when the cache is
+# opened and then tracked on every put; when it passes max_bytes the
+# folder is scanned once and trimmed to EVICT_TO of max_bytes, so a long
+# run does not stat the whole folder on every result.
+
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+# Bump when the scheduling rules change so old results are not reused
+CACHE_VERSION = 3
+
+# Share of max_bytes kept after an eviction
+EVICT_TO = 0.9
+
+class ScheduleCache:
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self._entries())
+
+    def make_key(self, prices, params):
+        """
+        Hash of the price data (time and lmp columns) and the scheduling parameters
+        """
+        h = hashlib.sha256()
+        h.update(f'v{CACHE_VERSION}'.encode())
+        for column in prices.columns:
+            series = prices[column]
+            if pd.api.types.is_datetime64_any_dtype(series):
+                if series.dt.tz is not None:
+                    series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+                values = series.to_numpy().astype('datetime64[ns]').astype(np.int64)
+            else:
+                values = series.to_numpy(dtype=np.float64)
+            h.update(column.encode())
+            h.update(np.ascontiguousarray(values).tobytes())
+        h.update(json.dumps(params, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            self.misses += 1
+            return None
+        os.utime(path)     # mark as recently used
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f)
+        replaced = os.path.getsize(path) if os.path.isfile(path) else 0
+        self.total_bytes += os.path.getsize(tmp_path) - replaced
+        os.replace(tmp_path, path)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def evict(self, target=None):
+        """
+        Remove least recently used results until the folder fits in target
+        (default EVICT_TO of max_bytes)
+        """
+        if target is None:
+            target = int(self.max_bytes * EVICT_TO)
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= target:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+        self.total_bytes = total
@@ -0,0 +1,297 @@
+# Schedule validation and compilation
+# Checks a testing schedule (Testing_schedule.csv, LSL or LSLS layout) or a
+# draw schedule (two columns, HH:MM:SS and gallons) once and compiles it
+# into a JSON timeline of absolute offsets in seconds after midnight of the
+# test day. WH_testing_1P.py/WH_testing_2P.py and DrawController_FM.py load
+# the compiled file next to the csv (same name, .json) and recompile it
+# only when the csv has changed, so a bad schedule is rejected before the
+# test starts instead of part way through the day.
+#
+# Testing schedule rules:
+#   - lines starting with '#' are comments
+#   - periods follow the column order (e.g. LU, S, RLU); a period whose
+#     start time is earlier than the previous start is on the next day,
+#     except the first period of a row: when it starts later than the
+#     second one it is on the evening before, as Testing_schedule.py writes
+#     a load-up for an early morning peak, e.g.
+#       23:00,2.0,01:00,4.0,13:00,4.0,17:00,5.0
+#     is M_LU 23:00 (-1d), M_S 01:00, E_LU 13:00, E_S 17:00
+#   - a time without a duration (or the reverse) is an error
+#   - durations are hours, more than 0 and at most 24
+#   - when periods overlap, the earlier period wins (as in the runners) and
+#     the later one is shortened, with a warning; gaps run the baseline 'e'
+#
+# Examples:
+#   python Schedule_compile.py Testing_schedule.csv
+#   python Schedule_compile.py --draws 12H-WDP.csv
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+from datetime import datetime
+
+# Schedule columns for both schedule layouts: (label, command, time column, duration column)
+SCHEDULE_PERIODS = [
+    ('LU', 'l', 'LU_time', 'LU_duration'),
+    ('S', 's', 'S_time', 'S_duration'),
+    ('RLU', 'l', 'RLU_time', 'RLU_duration'),
+    ('M_LU', 'l', 'M_LU_time', 'M_LU_duration'),
+    ('M_S', 's', 'M_S_time', 'M_S_duration'),
+    ('E_LU', 'l', 'E_LU_time', 'E_LU_duration'),
+    ('E_S', 's', 'E_S_time', 'E_S_duration'),
+]
+COMMANDS = {'e', 'l', 's'}      # baseline, load-up, shed
+TIMELINE_VERSION = 2     # 2: leading period on the evening before
+DAY = 24 * 3600
+
+class ScheduleError(ValueError):
+    """
+    A schedule that failed validation; `errors` lists every problem found
+    """
+    def __init__(self, source, errors):
+        self.source = source
+        self.errors = errors
+        super().__init__(f"{source}: " + '; '.join(errors))
+
+def compiled_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def _uncommented(f):
+    return (line for line in f if line.strip() and not line.lstrip().startswith('#'))
+
+def _time_of_day(text, fmt):
+    t = datetime.strptime(text.strip(), fmt).time()
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+def compile_schedule(path):
+    """
+    Validate a testing schedule csv and return its timeline, raising ScheduleError
+    """
+    errors = []
+    warnings = []
+    periods = []
+    with open(path, 'r') as f:
+        reader = csv.DictReader(_uncommented(f))
+        columns = reader.fieldnames or []
+        layout = [p for p in SCHEDULE_PERIODS if p[2] in columns or p[3] in columns]
+        if not layout:
+            raise ScheduleError(path, [f"no schedule columns found (header: {','.join(columns)})"])
+        known = {c for p in layout for c in p[2:]}
+        unknown = [c for c in columns if c not in known]
+        if unknown:
+            warnings.append(f"ignored columns: {','.join(unknown)}")
+
+        previous_start = None
+        for line, row in enumerate(reader, start=1):
+            items = []
+            for label, command, time_col, duration_col in layout:
+                time_text = (row.get(time_col) or '').strip()
+                duration_text = (row.get(duration_col) or '').strip()
+                where = f"row {line} {label}"
+                if not time_text and not duration_text:
+                    continue
+                if not time_text or not duration_text:
+                    errors.append(f"{where}: {time_col} and {duration_col} must both be set")
+                    continue
+                try:
+                    tod = _time_of_day(time_text, '%H:%M')
+                except ValueError:
+                    errors.append(f"{where}: bad time '{time_text}' (HH:MM)")
+                    continue
+                try:
+                    hours = float(duration_text)
+                except ValueError:
+                    errors.append(f"{where}: bad duration '{duration_text}' (hours)")
+                    continue
+                if not 0 < hours <= 24:
+                    errors.append(f"{where}: duration {hours} h out of range (0, 24]")
+                    continue
+                items.append((label, command, tod, int(round(hours * 3600))))
+
+            # A leading period that starts later in the day than the next one is on the
+            # evening before it (e.g. a 23:00 load-up for an early morning shed)
+            leading = items.pop(0) if len(items) > 1 and items[0][2] > items[1][2] else None
+            row_periods = []
+            for label, command, tod, seconds in items:
+                # Midnight wrap: a start earlier than the previous one is on the next day
+                start = tod
+                if previous_start is not None:
+                    start += (previous_start // DAY) * DAY
+                    if start < previous_start:
+                        start += DAY
+                previous_start = start
+                row_periods.append({'period': label, 'command': command, 'start': start,
+                                    'end': start + seconds, 'row': line})
+            if leading is not None:
+                label, command, tod, seconds = leading
+                start = row_periods[0]['start'] - (items[0][2] - tod) % DAY
+                row_periods.insert(0, {'period': label, 'command': command, 'start': start,
+                                       'end': start + seconds, 'row': line})
+            periods.extend(row_periods)
+
+    # Overlaps: the earlier period wins, like the first match in the runners
+    timeline = []
+    for period in periods:
+        if timeline and period['start'] < timeline[-1]['end']:
+            previous = timeline[-1]
+            if period['end'] <= previous['end']:
+                errors.append(f"{period['period']} lies entirely inside {previous['period']}")
+                continue
+            warnings.append(f"{period['period']} overlaps {previous['period']} by "
+                            f"{(previous['end'] - period['start']) / 60:.0f} min, starting it at the end of "
+                            f"{previous['period']}")
+            period = dict(period, start=previous['end'])
+        elif timeline and period['start'] > timeline[-1]['end']:
+            warnings.append(f"baseline 'e' for {(period['start'] - timeline[-1]['end']) / 3600:.2f} h "
+                            f"between {timeline[-1]['period']} and {period['period']}")
+        timeline.append(period)
+
+    if not timeline and not errors:
+        errors.append("no periods")
+    if errors:
+        raise ScheduleError(path, errors)
+    return {'version': TIMELINE_VERSION, 'kind': 'testing', 'source': os.path.basename(path),
+            'source_sha256': file_hash(path), 'periods': timeline, 'warnings': warnings}
+
+def compile_draw_schedule(path):
+    """
+    Validate a two-column draw schedule (HH:MM:SS, gallons) and return its timeline, raising ScheduleError
+    """
+    errors = []
+    warnings = []
+    draws = {}
+    with open(path, 'r') as f:
+        for line, row in enumerate(csv.reader(_uncommented(f)), start=1):
+            try:
+                t = _time_of_day(row[0], '%H:%M:%S')
+            except (IndexError, ValueError):
+                if line == 1:
+                    continue    # header line, any two names
+                errors.append(f"line {line}: bad time {row[0] if row else ''!r} (HH:MM:SS)")
+                continue
+            try:
+                volume = float(row[1])
+            except (IndexError, ValueError):
+                errors.append(f"line {line}: bad volume for {row[0].strip()}")
+                continue
+            if volume < 0:
+                errors.append(f"line {line}: negative volume at {row[0].strip()}")
+            elif volume == 0:
+                warnings.append(f"line {line}: zero volume at {row[0].strip()} skipped")
+            elif t in draws:
+                errors.append(f"line {line}: second draw at {row[0].strip()}")
+            else:
+                draws[t] = volume
+
+    if errors:
+        raise ScheduleError(path, errors)
+    return {'version': TIMELINE_VERSION, 'kind': 'draws', 'source': os.path.basename(path),
+            'source_sha256': file_hash(path), 'draws': sorted(draws.items()), 'warnings': warnings}
+
+def check_timeline(timeline, source):
+    """
+    Validate a loaded (possibly hand edited) timeline
+    """
+    errors = []
+    if timeline.get('version') != TIMELINE_VERSION:
+        errors.append(f"timeline version {timeline.get('version')} (expected {TIMELINE_VERSION})")
+    elif timeline.get('kind') == 'testing':
+        end = None
+        for p in timeline['periods']:
+            if p['command'] not in COMMANDS:
+                errors.append(f"{p['period']}: unknown command '{p['command']}'")
+            if p['end'] <= p['start'] or (end is not None and p['start'] < end):
+                errors.append(f"{p['period']}: empty or overlapping period")
+            end = p['end']
+    elif timeline.get('kind') == 'draws':
+        times = [t for t, _ in timeline['draws']]
+        if times != sorted(set(times)) or any(v <= 0 for _, v in timeline['draws']):
+            errors.append("draws must have increasing times and positive volumes")
+    else:
+        errors.append(f"unknown timeline kind {timeline.get('kind')!r}")
+    if errors:
+        raise ScheduleError(source, errors)
+    return timeline
+
+def save_timeline(timeline, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(timeline, f, indent=1)
+    os.replace(tmp_path, path)
+
+def load_compiled(path, compile_fn):
+    """
+    Timeline of the schedule csv at path: the compiled .json next to it if it is
+    up to date with the csv, otherwise the csv is compiled and the .json rewritten
+    """
+    json_path = compiled_path(path)
+    if os.path.isfile(json_path):
+        with open(json_path, 'r') as f:
+            try:
+                timeline = json.load(f)
+            except ValueError:
+                timeline = None
+        if timeline is not None and os.path.isfile(path) and timeline.get('version') != TIMELINE_VERSION:
+            timeline = None     # compiled by an older version, recompile
+        if timeline is not None and (not os.path.isfile(path) or timeline.get('source_sha256') == file_hash(path)):
+            return check_timeline(timeline, json_path)
+
+    timeline = compile_fn(path)
+    for warning in timeline['warnings']:
+        print(f"Schedule warning ({os.path.basename(path)}): {warning}")
+    save_timeline(timeline, json_path)
+    return timeline
+
+def load_schedule(path):
+    return load_compiled(path, compile_schedule)
+
+def load_draw_schedule(path):
+    return load_compiled(path, compile_draw_schedule)
+
+def format_offset(seconds):
+    day, seconds = divmod(int(seconds), DAY)
+    text = f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+    return text + (f' ({day:+d}d)' if day else '')
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate and compile schedules to JSON timelines')
+    parser.add_argument('files', nargs='+', help='Testing_schedule csv files (or draw schedules with --draws)')
+    parser.add_argument('--draws', action='store_true', help='the files are two-column draw schedules')
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.files:
+        try:
+            timeline = (compile_draw_schedule if args.draws else compile_schedule)(path)
+        except ScheduleError as e:
+            failed = True
+            print(f"{path}: REJECTED")
+            for error in e.errors:
+                print(f"  error: {error}")
+            continue
+        except OSError as e:
+            failed = True
+            print(f"{path}: {e}")
+            continue
+
+        save_timeline(timeline, compiled_path(path))
+        print(f"{path}: compiled to {compiled_path(path)}")
+        if args.draws:
+            print(f"  {len(timeline['draws'])} draws, {sum(v for _, v in timeline['draws']):.2f} gallons")
+        else:
+            for p in timeline['periods']:
+                print(f"  {p['period']:5s} {p['command']}  {format_offset(p['start'])} - {format_offset(p['end'])}")
+        for warning in timeline['warnings']:
+            print(f"  warning: {warning}")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
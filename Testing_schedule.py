@@ -1,15 +1,20 @@
 # Script for Shed time and duration
 
+import argparse
+import csv
+import itertools
+import os
 
-# Read the CSV file
-file_path = '/content/drive/MyDrive/PSU/GoogleColab/GridStatus/DAMDatasets/DAM10102024.csv'
-df = pd.read_csv(file_path)
+import pandas as pd
+from scipy.signal import find_peaks
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
 
-# Convert the 'interval_start_utc' column to datetime
-df['interval_start_utc'] = pd.to_datetime(df['interval_start_utc'])
+from Schedule_cache import ScheduleCache
+from DAM_ingest import iter_dam_days, floor_hour
 
-# Shift the time 7 hours back
-df['interval_start_utc'] = df['interval_start_utc'] - pd.Timedelta(hours=7)
+# Read the CSV file
+file_path = '/content/drive/MyDrive/PSU/GoogleColab/GridStatus/DAMDatasets/DAM10102024.csv'
 
 def split_day_periods(df):
     """
@@ -21,41 +26,54 @@ def split_day_periods(df):
     evening_df = df[df['hour'] >= 12].copy()
     return morning_df, evening_df
 
-def identify_period_peaks(df, prominence_threshold=0.08, distance=4, width=1):
+def detect_period_peaks(df, prominence_threshold=0.08, distance=4, width=1,
+                        evening_prominence=0.05, height_std=0.25, fallback_hours=(17, 19)):
     """
-    Modified peak detection with lower evening threshold
+    Peak detection for one period, also reporting whether the evening fallback was used
     """
     df = df.sort_values('interval_start_utc')
     first_hour = df['interval_start_utc'].iloc[0].hour
 
     # Lower threshold for evening to ensure peak detection
     if first_hour >= 12:
-        prominence_threshold = 0.05  # More sensitive for evening
+        prominence_threshold = evening_prominence  # More sensitive for evening
 
-    price_range = df['lmp'].max() - df['lmp'].min()
-    mean_price = df['lmp'].mean()
+    lmp = df['lmp'].to_numpy()
+    price_range = lmp.max() - lmp.min()
+    mean_price = lmp.mean()
     std_price = df['lmp'].std()
 
-    peaks, properties = find_peaks(df['lmp'],
+    peaks, properties = find_peaks(lmp,
                                  prominence=prominence_threshold * price_range,
                                  distance=distance,
                                  width=width,
-                                 height=mean_price - 0.25 * std_price)
+                                 height=mean_price - height_std * std_price)
 
     peak_times = df['interval_start_utc'].iloc[peaks]
     peak_prices = df['lmp'].iloc[peaks]
-    peak_times = peak_times.dt.floor('H')
+    peak_times = floor_hour(peak_times)
 
     # Ensure evening peak detection
+    used_fallback = False
     if first_hour >= 12 and len(peaks) == 0:
         # Find highest price point in typical evening peak hours (17-19)
-        evening_df = df[df['interval_start_utc'].dt.hour.between(17, 19)]
+        evening_df = df[df['interval_start_utc'].dt.hour.between(*fallback_hours)]
         if not evening_df.empty:
             max_idx = evening_df['lmp'].idxmax()
             peak_times = pd.Series([df.loc[max_idx, 'interval_start_utc']])
             peak_prices = pd.Series([df.loc[max_idx, 'lmp']])
+            used_fallback = True
 
     peak_data = sorted(zip(peak_times, peak_prices), key=lambda x: x[0])
+    return peak_data, used_fallback
+
+def identify_period_peaks(df, prominence_threshold=0.08, distance=4, width=1,
+                          evening_prominence=0.05, height_std=0.25, fallback_hours=(17, 19)):
+    """
+    Modified peak detection with lower evening threshold
+    """
+    peak_data, _ = detect_period_peaks(df, prominence_threshold, distance, width,
+                                       evening_prominence, height_std, fallback_hours)
     return peak_data
 
 def identify_load_up_periods(df_period, peak_data, is_morning=True):
@@ -98,8 +116,12 @@ def identify_shed_periods(df_period, peak_data, is_morning=True):
             # Evening shed starts 2 hours before peak
             start_time = peak_time - pd.Timedelta(hours=2)
         
+        # The shed cannot start before the data of the period (a peak in the first
+        # hours of the day, or a partial first day of an export)
+        start_time = max(start_time, df_period['interval_start_utc'].min())
+
         # Get price at start of shed period
-        start_price = df_period[df_period['interval_start_utc'] == start_time]['lmp'].iloc[0]
+        start_price = df_period[df_period['interval_start_utc'] >= start_time]['lmp'].iloc[0]
         
         # Look for price drop below start price after peak
         post_peak = df_period[df_period['interval_start_utc'] > peak_time]
@@ -200,8 +222,9 @@ def visualize_split_peaks(df, morning_peaks, evening_peaks, morning_loadup, even
     plt.xlabel('Time')
     plt.ylabel('LMP ($)')
 
-    hours = mdates.HourLocator(interval=2)
-    h_fmt = mdates.DateFormatter('%H:%M')
+    tz = df['interval_start_utc'].dt.tz     # label the axis in local market time
+    hours = mdates.HourLocator(interval=2, tz=tz)
+    h_fmt = mdates.DateFormatter('%H:%M', tz=tz)
     plt.gca().xaxis.set_major_locator(hours)
     plt.gca().xaxis.set_major_formatter(h_fmt)
     plt.xlim(df['interval_start_utc'].min(), df['interval_start_utc'].max())
@@ -213,33 +236,6 @@ def visualize_split_peaks(df, morning_peaks, evening_peaks, morning_loadup, even
 
     return plt.gcf()
 
-# Split the data into periods
-morning_df, evening_df = split_day_periods(df)
-
-# Identify peaks for each period
-morning_peaks = identify_period_peaks(morning_df)
-evening_peaks = identify_period_peaks(evening_df)
-
-# Identify load-up periods
-morning_loadup = identify_load_up_periods(morning_df, morning_peaks, is_morning=True)
-evening_loadup = identify_load_up_periods(evening_df, evening_peaks, is_morning=False)
-
-# Identify shed periods
-morning_shed = identify_shed_periods(morning_df, morning_peaks, is_morning=True)
-evening_shed = identify_shed_periods(evening_df, evening_peaks, is_morning=False)
-
-# Resolve overlaps
-morning_loadup, morning_shed = resolve_period_overlaps(morning_loadup, morning_shed)
-evening_loadup, evening_shed = resolve_period_overlaps(evening_loadup, evening_shed)
-
-# Create visualization
-fig = visualize_split_peaks(df, morning_peaks, evening_peaks,
-                          morning_loadup, evening_loadup,
-                          morning_shed, evening_shed)
-plt.show()
-# Save the plot
-#plt.savefig('/content/drive/MyDrive/PSU/GoogleColab/GridStatus/DAMDatasets/DAM10102024.png',dpi=300)
-
 def create_data_for_csv(morning_loadup, morning_shed, evening_loadup, evening_shed):
     """
     Create CSV data combining morning and evening periods in one line
@@ -288,7 +284,11 @@ def create_data_for_csv(morning_loadup, morning_shed, evening_loadup, evening_sh
     data.append(row)
     return data
 
-def save_schedule_to_csv(df, morning_loadup, morning_shed, evening_loadup, evening_shed):
+def format_hours(duration):
+    # Durations are '' when a period has no peak
+    return f"{duration:.1f}" if duration != '' else '-'
+
+def save_schedule_to_csv(df, morning_loadup, morning_shed, evening_loadup, evening_shed, output_dir=None):
     """
     Save schedule data to CSV file with one header line and one data line
     """
@@ -298,7 +298,9 @@ def save_schedule_to_csv(df, morning_loadup, morning_shed, evening_loadup, eveni
     # Generate filename with date
     date_str = df['interval_start_utc'].iloc[0].strftime('%Y%m%d')
     csv_filename = f'Schedule_{date_str}.csv'
-    csv_path = os.path.join(os.path.dirname(file_path), csv_filename)
+    if output_dir is None:
+        output_dir = os.path.dirname(file_path)
+    csv_path = os.path.join(output_dir, csv_filename)
     
     # Write to CSV
     fieldnames = ['M_LU_time', 'M_LU_duration', 'M_S_time', 'M_S_duration',
@@ -315,62 +317,159 @@ def save_schedule_to_csv(df, morning_loadup, morning_shed, evening_loadup, eveni
     print("\nSchedule Summary:")
     for row in csv_data:
         print("Morning:")
-        print(f"  Load-up: {row['M_LU_time']} ({row['M_LU_duration']:.1f} hours)")
-        print(f"  Shed: {row['M_S_time']} ({row['M_S_duration']:.1f} hours)")
+        print(f"  Load-up: {row['M_LU_time']} ({format_hours(row['M_LU_duration'])} hours)")
+        print(f"  Shed: {row['M_S_time']} ({format_hours(row['M_S_duration'])} hours)")
         print("Evening:")
-        print(f"  Load-up: {row['E_LU_time']} ({row['E_LU_duration']:.1f} hours)")
-        print(f"  Shed: {row['E_S_time']} ({row['E_S_duration']:.1f} hours)")
-
-
-# Print detailed information
-print("\nMorning Peaks:")
-for i, (peak_time, peak_price) in enumerate(morning_peaks, 1):
-    print(f"Peak {i}:")
-    print(f"  Time: {peak_time.strftime('%Y-%m-%d %H:%M')}")
-    print(f"  LMP: ${peak_price:.2f}")
-    print()
-
-print("Evening Peaks:")
-for i, (peak_time, peak_price) in enumerate(evening_peaks, 1):
-    print(f"Peak {i}:")
-    print(f"  Time: {peak_time.strftime('%Y-%m-%d %H:%M')}")
-    print(f"  LMP: ${peak_price:.2f}")
-    print()
-
-print("\nMorning Load-up Periods:")
-for i, (start_time, end_time, peak_time) in enumerate(morning_loadup, 1):
-    print(f"Period {i}:")
-    print(f"  Start: {start_time.strftime('%H:%M')}")
-    print(f"  End: {end_time.strftime('%H:%M')}")
-    print(f"  Duration: {(end_time - start_time).total_seconds() / 3600:.1f} hours")
-    print(f"  For Peak at: {peak_time.strftime('%H:%M')}")
-    print()
-
-print("Evening Load-up Periods:")
-for i, (start_time, end_time, peak_time) in enumerate(evening_loadup, 1):
-    print(f"Period {i}:")
-    print(f"  Start: {start_time.strftime('%H:%M')}")
-    print(f"  End: {end_time.strftime('%H:%M')}")
-    print(f"  Duration: {(end_time - start_time).total_seconds() / 3600:.1f} hours")
-    print(f"  For Peak at: {peak_time.strftime('%H:%M')}")
-    print()
-
-print("\nMorning Shed Periods:")
-for i, (start_time, end_time, peak_time) in enumerate(morning_shed, 1):
-    print(f"Period {i}:")
-    print(f"  Start: {start_time.strftime('%H:%M')}")
-    print(f"  End: {end_time.strftime('%H:%M')}")
-    print(f"  Duration: {(end_time - start_time).total_seconds() / 3600:.1f} hours")
-    print(f"  For Peak at: {peak_time.strftime('%H:%M')}")
-    print()
-
-print("Evening Shed Periods:")
-for i, (start_time, end_time, peak_time) in enumerate(evening_shed, 1):
-    print(f"Period {i}:")
-    print(f"  Start: {start_time.strftime('%H:%M')}")
-    print(f"  End: {end_time.strftime('%H:%M')}")
-    print(f"  Duration: {(end_time - start_time).total_seconds() / 3600:.1f} hours")
-    print(f"  For Peak at: {peak_time.strftime('%H:%M')}")
-    print()
-
-save_schedule_to_csv(df, morning_loadup, morning_shed, evening_loadup, evening_shed)
+        print(f"  Load-up: {row['E_LU_time']} ({format_hours(row['E_LU_duration'])} hours)")
+        print(f"  Shed: {row['E_S_time']} ({format_hours(row['E_S_duration'])} hours)")
+
+def compute_schedule(df, prominence_threshold=0.08, distance=4, width=1,
+                     evening_prominence=0.05, height_std=0.25, fallback_hours=(17, 19)):
+    """
+    Peaks, load-up and shed periods for one day of DAM data
+    """
+    peak_params = {'prominence_threshold': prominence_threshold, 'distance': distance, 'width': width,
+                   'evening_prominence': evening_prominence, 'height_std': height_std,
+                   'fallback_hours': fallback_hours}
+
+    # Split the data into periods
+    morning_df, evening_df = split_day_periods(df)
+
+    # Identify peaks for each period
+    morning_peaks, _ = detect_period_peaks(morning_df, **peak_params)
+    evening_peaks, evening_fallback = detect_period_peaks(evening_df, **peak_params)
+
+    # Identify load-up periods
+    morning_loadup = identify_load_up_periods(morning_df, morning_peaks, is_morning=True)
+    evening_loadup = identify_load_up_periods(evening_df, evening_peaks, is_morning=False)
+
+    # Identify shed periods
+    morning_shed = identify_shed_periods(morning_df, morning_peaks, is_morning=True)
+    evening_shed = identify_shed_periods(evening_df, evening_peaks, is_morning=False)
+
+    # Resolve overlaps
+    morning_loadup, morning_shed = resolve_period_overlaps(morning_loadup, morning_shed)
+    evening_loadup, evening_shed = resolve_period_overlaps(evening_loadup, evening_shed)
+
+    return {
+        'morning_peaks': morning_peaks,
+        'evening_peaks': evening_peaks,
+        'evening_fallback': evening_fallback,
+        'morning_loadup': morning_loadup,
+        'evening_loadup': evening_loadup,
+        'morning_shed': morning_shed,
+        'evening_shed': evening_shed,
+        'schedule': create_data_for_csv(morning_loadup, morning_shed, evening_loadup, evening_shed),
+    }
+
+def print_schedule_details(result):
+    """
+    Print detailed information
+    """
+    morning_peaks, evening_peaks = result['morning_peaks'], result['evening_peaks']
+    morning_loadup, evening_loadup = result['morning_loadup'], result['evening_loadup']
+    morning_shed, evening_shed = result['morning_shed'], result['evening_shed']
+
+    print("\nMorning Peaks:")
+    for i, (peak_time, peak_price) in enumerate(morning_peaks, 1):
+        print(f"Peak {i}:")
+        print(f"  Time: {peak_time.strftime('%Y-%m-%d %H:%M')}")
+        print(f"  LMP: ${peak_price:.2f}")
+        print()
+
+    print("Evening Peaks:")
+    for i, (peak_time, peak_price) in enumerate(evening_peaks, 1):
+        print(f"Peak {i}:")
+        print(f"  Time: {peak_time.strftime('%Y-%m-%d %H:%M')}")
+        print(f"  LMP: ${peak_price:.2f}")
+        print()
+
+    print("\nMorning Load-up Periods:")
+    for i, (start_time, end_time, peak_time) in enumerate(morning_loadup, 1):
+        print(f"Period {i}:")
+        print(f"  Start: {start_time.strftime('%H:%M')}")
+        print(f"  End: {end_time.strftime('%H:%M')}")
+        print(f"  Duration: {(end_time - start_time).total_seconds() / 3600:.1f} hours")
+        print(f"  For Peak at: {peak_time.strftime('%H:%M')}")
+        print()
+
+    print("Evening Load-up Periods:")
+    for i, (start_time, end_time, peak_time) in enumerate(evening_loadup, 1):
+        print(f"Period {i}:")
+        print(f"  Start: {start_time.strftime('%H:%M')}")
+        print(f"  End: {end_time.strftime('%H:%M')}")
+        print(f"  Duration: {(end_time - start_time).total_seconds() / 3600:.1f} hours")
+        print(f"  For Peak at: {peak_time.strftime('%H:%M')}")
+        print()
+
+    print("\nMorning Shed Periods:")
+    for i, (start_time, end_time, peak_time) in enumerate(morning_shed, 1):
+        print(f"Period {i}:")
+        print(f"  Start: {start_time.strftime('%H:%M')}")
+        print(f"  End: {end_time.strftime('%H:%M')}")
+        print(f"  Duration: {(end_time - start_time).total_seconds() / 3600:.1f} hours")
+        print(f"  For Peak at: {peak_time.strftime('%H:%M')}")
+        print()
+
+    print("Evening Shed Periods:")
+    for i, (start_time, end_time, peak_time) in enumerate(evening_shed, 1):
+        print(f"Period {i}:")
+        print(f"  Start: {start_time.strftime('%H:%M')}")
+        print(f"  End: {end_time.strftime('%H:%M')}")
+        print(f"  Duration: {(end_time - start_time).total_seconds() / 3600:.1f} hours")
+        print(f"  For Peak at: {peak_time.strftime('%H:%M')}")
+        print()
+
+def schedule_day(df, params, cache=None):
+    """
+    Schedule one DAM day, reusing a cached result when the prices and parameters are unchanged
+    """
+    key = cache.make_key(df[['interval_start_utc', 'lmp']], params) if cache else None
+    result = cache.get(key) if cache else None
+    if result is None:
+        result = compute_schedule(df, **params)
+        if cache:
+            cache.put(key, result)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Automatic load-up and shed schedule from DAM prices')
+    parser.add_argument('files', nargs='*', default=[file_path], help='DAM csv files (single or multi-day exports)')
+    parser.add_argument('--prominence-threshold', type=float, default=0.08)
+    parser.add_argument('--distance', type=int, default=4)
+    parser.add_argument('--width', type=int, default=1)
+    parser.add_argument('--cache-dir', default='.schedule_cache', help='result cache folder ("" to disable)')
+    parser.add_argument('--cache-size-mb', type=float, default=100)
+    parser.add_argument('--quiet', action='store_true', help='no plot or details, only the saved schedules')
+    args = parser.parse_args()
+
+    params = {'prominence_threshold': args.prominence_threshold, 'distance': args.distance, 'width': args.width}
+    cache = ScheduleCache(args.cache_dir, int(args.cache_size_mb * 1024 * 1024)) if args.cache_dir else None
+    days = ((path, date, df) for path in args.files for date, df in iter_dam_days(path))
+    # Plot and print details only for a single day; a multi-day export would
+    # otherwise open one blocking plot per day
+    first_days = list(itertools.islice(days, 2))
+    show_details = len(first_days) == 1 and not args.quiet
+
+    for path, date, df in itertools.chain(first_days, days):
+        result = schedule_day(df, params, cache)
+
+        if show_details:
+            # Create visualization
+            fig = visualize_split_peaks(df, result['morning_peaks'], result['evening_peaks'],
+                                      result['morning_loadup'], result['evening_loadup'],
+                                      result['morning_shed'], result['evening_shed'])
+            plt.show()
+            # Save the plot
+            #plt.savefig('/content/drive/MyDrive/PSU/GoogleColab/GridStatus/DAMDatasets/DAM10102024.png',dpi=300)
+            print_schedule_details(result)
+
+        save_schedule_to_csv(df, result['morning_loadup'], result['morning_shed'],
+                             result['evening_loadup'], result['evening_shed'],
+                             output_dir=os.path.dirname(path))
+
+    if cache:
+        print(f"Cache: {cache.hits} reused, {cache.misses} computed")
+
+if __name__ == "__main__":
+    main()
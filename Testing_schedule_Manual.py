@@ -3,7 +3,31 @@
 # starting time and duration
 # The output of the scrip is a data graph with
 # shedding the "Load-up" and "Shed" periods
-
+#
+# Batch mode: instead of typing the offsets, give one or more plan files
+# and any number of DAM days; each day/plan pair is processed in parallel
+# and writes <out-dir>/<YYYYMMDD>/<plan>/Testing_schedule.csv and Plan_X.png
+#   python Testing_schedule_Manual.py --plan Plan_A.json --plan Plan_E.json DAM*.csv
+#
+# A plan file gives the offsets per peak, selected by peak number (1-based),
+# by a time of day window for the peak, or as a default for any peak:
+# {
+#   "name": "Plan E",
+#   "include_recovery": true,
+#   "peaks": [
+#     {"peak": 1, "load_up_hours_before": 4, "load_up_duration": 2,
+#      "shed_hours_after_load_up": 0, "shed_duration": 3,
+#      "recovery_hours_after_shed": 0, "recovery_duration": 2},
+#     {"from": "12:00", "to": "24:00", "load_up_hours_before": 5, ...},
+#     {"load_up_hours_before": 3, ...}
+#   ]
+# }
+
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 import numpy as np
@@ -11,15 +35,12 @@ from scipy.signal import find_peaks
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+from DAM_ingest import iter_dam_days, load_dam_day, floor_hour
+
 # Read the CSV file
 file_path = '/content/drive/MyDrive/PSU/GoogleColab/GridStatus/DAMDatasets/DAM10032024.csv'
-df = pd.read_csv(file_path)
 
-# Convert the 'interval_start_utc' column to datetime
-df['interval_start_utc'] = pd.to_datetime(df['interval_start_utc'])
-
-# Shift the time 7 hours back
-df['interval_start_utc'] = df['interval_start_utc'] - pd.Timedelta(hours=7)
+SCHEDULE_FIELDS = ['LU_time', 'LU_duration', 'S_time', 'S_duration', 'RLU_time', 'RLU_duration']
 
 def identify_peak_periods(df, prominence_threshold=0.05, distance=1, width=1):
     df = df.sort_values('interval_start_utc')
@@ -27,16 +48,37 @@ def identify_peak_periods(df, prominence_threshold=0.05, distance=1, width=1):
                                    distance=distance, width=width)
     peak_times = df['interval_start_utc'].iloc[peaks]
     peak_prices = df['lmp'].iloc[peaks]
-    peak_times = peak_times.dt.floor('H')
+    peak_times = floor_hour(peak_times)
     peak_data = sorted(zip(peak_times, peak_prices), key=lambda x: x[0])
     return peak_data
 
-def manual_load_up_times(df, peak_data):
+def plan_for_peak(plan, index, peak_time):
+    """
+    Plan entry for the peak: matched by peak number, then by time of day window, then the default
+    """
+    peak_hhmm = peak_time.strftime('%H:%M')
+    for entry in plan['peaks']:
+        if entry.get('peak') == index + 1:
+            return entry
+    for entry in plan['peaks']:
+        if 'from' in entry and entry['from'] <= peak_hhmm < entry.get('to', '24:00'):
+            return entry
+    for entry in plan['peaks']:
+        if 'peak' not in entry and 'from' not in entry:
+            return entry
+    return None
+
+def manual_load_up_times(df, peak_data, plan=None):
     load_up_times = []
-    for peak_time, peak_price in peak_data:
-        print(f"\nPeak at {peak_time.strftime('%Y-%m-%d %H:%M')} (LMP: ${peak_price:.2f})")
-        hours_before = int(input("Hours before peak to start load-up: "))
-        duration = int(input("Duration of load-up (hours): "))
+    for i, (peak_time, peak_price) in enumerate(peak_data):
+        if plan:
+            entry = plan_for_peak(plan, i, peak_time)
+            hours_before = entry['load_up_hours_before']
+            duration = entry['load_up_duration']
+        else:
+            print(f"\nPeak at {peak_time.strftime('%Y-%m-%d %H:%M')} (LMP: ${peak_price:.2f})")
+            hours_before = int(input("Hours before peak to start load-up: "))
+            duration = int(input("Duration of load-up (hours): "))
 
         load_up_start = peak_time - pd.Timedelta(hours=hours_before)
         load_up_end = load_up_start + pd.Timedelta(hours=duration)
@@ -44,13 +86,18 @@ def manual_load_up_times(df, peak_data):
         load_up_times.append((load_up_start, load_up_end, peak_time))
     return load_up_times
 
-def manual_shed_periods(df, peak_data, load_up_times):
+def manual_shed_periods(df, peak_data, load_up_times, plan=None):
     shed_periods = []
-    for (load_up_start, load_up_end, peak_time), (peak_time, peak_price) in zip(load_up_times, peak_data):
-        print(f"\nPeak at {peak_time.strftime('%Y-%m-%d %H:%M')} (LMP: ${peak_price:.2f})")
-        print(f"Load-up ends at {load_up_end.strftime('%Y-%m-%d %H:%M')}")
-        hours_after_loadup = float(input("Hours after load-up to start shed: "))
-        duration = float(input("Duration of shed (hours): "))
+    for i, ((load_up_start, load_up_end, peak_time), (peak_time, peak_price)) in enumerate(zip(load_up_times, peak_data)):
+        if plan:
+            entry = plan_for_peak(plan, i, peak_time)
+            hours_after_loadup = entry['shed_hours_after_load_up']
+            duration = entry['shed_duration']
+        else:
+            print(f"\nPeak at {peak_time.strftime('%Y-%m-%d %H:%M')} (LMP: ${peak_price:.2f})")
+            print(f"Load-up ends at {load_up_end.strftime('%Y-%m-%d %H:%M')}")
+            hours_after_loadup = float(input("Hours after load-up to start shed: "))
+            duration = float(input("Duration of shed (hours): "))
 
         shed_start = load_up_end + pd.Timedelta(hours=hours_after_loadup)
         shed_end = shed_start + pd.Timedelta(hours=duration)
@@ -58,15 +105,25 @@ def manual_shed_periods(df, peak_data, load_up_times):
         shed_periods.append((shed_start, shed_end, peak_time))
     return shed_periods
 
-def manual_recovery_load_up_time(shed_periods):
+def manual_recovery_load_up_time(shed_periods, plan=None):
     recovery_times = []
-    include_recovery = input("\nDo you want to include recovery load-up? (yes/no): ").lower() == 'yes'
+    if plan:
+        include_recovery = plan.get('include_recovery', False)
+    else:
+        include_recovery = input("\nDo you want to include recovery load-up? (yes/no): ").lower() == 'yes'
 
     if include_recovery:
-        for shed_start, shed_end, peak_time in shed_periods:
-            print(f"\nShed period ends at {shed_end.strftime('%Y-%m-%d %H:%M')}")
-            hours_after_shed = float(input("Hours after shed to start recovery: "))
-            duration = float(input("Duration of recovery (hours): "))
+        for i, (shed_start, shed_end, peak_time) in enumerate(shed_periods):
+            if plan:
+                entry = plan_for_peak(plan, i, peak_time)
+                if 'recovery_duration' not in entry:
+                    continue
+                hours_after_shed = entry.get('recovery_hours_after_shed', 0)
+                duration = entry['recovery_duration']
+            else:
+                print(f"\nShed period ends at {shed_end.strftime('%Y-%m-%d %H:%M')}")
+                hours_after_shed = float(input("Hours after shed to start recovery: "))
+                duration = float(input("Duration of recovery (hours): "))
 
             recovery_start = shed_end + pd.Timedelta(hours=hours_after_shed)
             recovery_end = recovery_start + pd.Timedelta(hours=duration)
@@ -75,104 +132,93 @@ def manual_recovery_load_up_time(shed_periods):
 
     return recovery_times, include_recovery
 
-# Identify peaks
-peak_data = identify_peak_periods(df)
-
-# Manual input for load-up times
-load_up_times = manual_load_up_times(df, peak_data)
-
-# Manual input for shed periods
-shed_periods = manual_shed_periods(df, peak_data, load_up_times)
-
-# Manual input for recovery load-up times
-recovery_times, include_recovery = manual_recovery_load_up_time(shed_periods)
-
-# Visualization
-plt.figure(figsize=(12, 6))
-plt.plot(df['interval_start_utc'], df['lmp'], color='navy', label='LMP')
-
-for i, (peak_time, peak_price) in enumerate(peak_data):
-    plt.axvline(x=peak_time, color=f'C{i+1}', linestyle='--', label=f'Peak {i+1}')
-    #plt.text(peak_time, peak_price, f'${peak_price:.2f}',
-     #        verticalalignment='bottom', horizontalalignment='center')
-
-for i, (start, end, peak) in enumerate(load_up_times):
-    plt.axvspan(start, end, color='green', alpha=0.3, label=f'Load-up {i+1}')
-
-for i, (start, end, peak) in enumerate(shed_periods):
-    #plt.axvspan(start, end, color='red', alpha=0.3, hatch='\\', label=f'Shed {i+1}')
-    plt.axvspan(start, end, color='red', alpha=0.3, label=f'Shed {i+1}')
-
-
-if include_recovery:
-    for i, (start, end, peak) in enumerate(recovery_times):
-        plt.axvspan(start, end, color='blue', alpha=0.3, label=f'Recovery {i+1}')
-
-#plt.title('Locational Marginal Price - CAISO with Peaks, Load-up, Shed, and Recovery Periods')
-plt.title('Locational Marginal Price - CAISO - Plan E')
-
-plt.xlabel('Time')
-plt.ylabel('LMP ($)')
-
-hours = mdates.HourLocator(interval=1)
-h_fmt = mdates.DateFormatter('%H:%M')
-plt.gca().xaxis.set_major_locator(hours)
-plt.gca().xaxis.set_major_formatter(h_fmt)
-plt.xlim(df['interval_start_utc'].min(), df['interval_start_utc'].max())
-plt.gca().xaxis.set_minor_locator(mdates.HourLocator())
-plt.xticks(rotation=0)
-plt.grid(True, linestyle='--', alpha=0.7)
-
-legend_elements = [plt.Line2D([0], [0], color='navy', label='LMP')]
-legend_elements.extend([plt.Line2D([0], [0], color=f'C{i+1}', linestyle='--', label=f'Peak {i+1}') for i in range(len(peak_data))])
-legend_elements.extend([plt.Rectangle((0, 0), 1, 1, fc='green', alpha=0.3, label=f'Load-up {i+1}') for i in range(len(load_up_times))])
-#legend_elements.extend([plt.Rectangle((0, 0), 1, 1, fc='red', alpha=0.3, hatch='\\', label=f'Shed {i+1}') for i in range(len(shed_periods))])
-legend_elements.extend([plt.Rectangle((0, 0), 1, 1, fc='red', alpha=0.3, label=f'Shed {i+1}') for i in range(len(shed_periods))])
-
-if include_recovery:
-    #legend_elements.extend([plt.Rectangle((0, 0), 1, 1, fc='blue', alpha=0.3, label=f'Load-up 2 {i+1}') for i in range(len(recovery_times))])
-    legend_elements.extend([plt.Rectangle((0, 0), 1, 1, fc='blue', alpha=0.3, label=f'Load-up 2') for i in range(len(recovery_times))])
-
-
-plt.legend(handles=legend_elements)
-plt.tight_layout()
-plt.savefig('/content/drive/MyDrive/PSU/GoogleColab/GridStatus/Plan_E.png',dpi=300)
-plt.show()
-
-# Print information
-print("\nIdentified Peaks:")
-for i, (peak_time, peak_price) in enumerate(peak_data):
-    print(f"Peak {i+1}:")
-    print(f"  Time: {peak_time.strftime('%Y-%m-%d %H:%M')}")
-    print(f"  LMP: ${peak_price:.2f}")
-    print()
-
-print("Load-up Periods:")
-for i, (start, end, peak) in enumerate(load_up_times):
-    print(f"Load-up {i+1}:")
-    print(f"  Start: {start.strftime('%Y-%m-%d %H:%M')}")
-    print(f"  End: {end.strftime('%Y-%m-%d %H:%M')}")
-    print(f"  For Peak at: {peak.strftime('%Y-%m-%d %H:%M')}")
-    print()
-
-print("Shed Periods:")
-for i, (start, end, peak) in enumerate(shed_periods):
-    print(f"Shed {i+1}:")
-    print(f"  Start: {start.strftime('%Y-%m-%d %H:%M')}")
-    print(f"  End: {end.strftime('%Y-%m-%d %H:%M')}")
-    print(f"  Duration: {(end - start).total_seconds() / 3600:.2f} hours")
-    print(f"  For Peak at: {peak.strftime('%Y-%m-%d %H:%M')}")
-    print()
-
-if include_recovery:
-    print("Recovery Load-up Times:")
-    for i, (start, end, peak_time) in enumerate(recovery_times):
-        print(f"Recovery {i+1}:")
+def plot_plan(df, peak_data, load_up_times, shed_periods, recovery_times, include_recovery, title):
+    plt.figure(figsize=(12, 6))
+    plt.plot(df['interval_start_utc'], df['lmp'], color='navy', label='LMP')
+
+    for i, (peak_time, peak_price) in enumerate(peak_data):
+        plt.axvline(x=peak_time, color=f'C{i+1}', linestyle='--', label=f'Peak {i+1}')
+        #plt.text(peak_time, peak_price, f'${peak_price:.2f}',
+         #        verticalalignment='bottom', horizontalalignment='center')
+
+    for i, (start, end, peak) in enumerate(load_up_times):
+        plt.axvspan(start, end, color='green', alpha=0.3, label=f'Load-up {i+1}')
+
+    for i, (start, end, peak) in enumerate(shed_periods):
+        #plt.axvspan(start, end, color='red', alpha=0.3, hatch='\\', label=f'Shed {i+1}')
+        plt.axvspan(start, end, color='red', alpha=0.3, label=f'Shed {i+1}')
+
+
+    if include_recovery:
+        for i, (start, end, peak) in enumerate(recovery_times):
+            plt.axvspan(start, end, color='blue', alpha=0.3, label=f'Recovery {i+1}')
+
+    #plt.title('Locational Marginal Price - CAISO with Peaks, Load-up, Shed, and Recovery Periods')
+    plt.title(f'Locational Marginal Price - CAISO - {title}')
+
+    plt.xlabel('Time')
+    plt.ylabel('LMP ($)')
+
+    tz = df['interval_start_utc'].dt.tz     # label the axis in local market time
+    hours = mdates.HourLocator(interval=1, tz=tz)
+    h_fmt = mdates.DateFormatter('%H:%M', tz=tz)
+    plt.gca().xaxis.set_major_locator(hours)
+    plt.gca().xaxis.set_major_formatter(h_fmt)
+    plt.xlim(df['interval_start_utc'].min(), df['interval_start_utc'].max())
+    plt.gca().xaxis.set_minor_locator(mdates.HourLocator(tz=tz))
+    plt.xticks(rotation=0)
+    plt.grid(True, linestyle='--', alpha=0.7)
+
+    legend_elements = [plt.Line2D([0], [0], color='navy', label='LMP')]
+    legend_elements.extend([plt.Line2D([0], [0], color=f'C{i+1}', linestyle='--', label=f'Peak {i+1}') for i in range(len(peak_data))])
+    legend_elements.extend([plt.Rectangle((0, 0), 1, 1, fc='green', alpha=0.3, label=f'Load-up {i+1}') for i in range(len(load_up_times))])
+    #legend_elements.extend([plt.Rectangle((0, 0), 1, 1, fc='red', alpha=0.3, hatch='\\', label=f'Shed {i+1}') for i in range(len(shed_periods))])
+    legend_elements.extend([plt.Rectangle((0, 0), 1, 1, fc='red', alpha=0.3, label=f'Shed {i+1}') for i in range(len(shed_periods))])
+
+    if include_recovery:
+        #legend_elements.extend([plt.Rectangle((0, 0), 1, 1, fc='blue', alpha=0.3, label=f'Load-up 2 {i+1}') for i in range(len(recovery_times))])
+        legend_elements.extend([plt.Rectangle((0, 0), 1, 1, fc='blue', alpha=0.3, label=f'Load-up 2') for i in range(len(recovery_times))])
+
+
+    plt.legend(handles=legend_elements)
+    plt.tight_layout()
+    return plt.gcf()
+
+def print_plan(peak_data, load_up_times, shed_periods, recovery_times, include_recovery):
+    # Print information
+    print("\nIdentified Peaks:")
+    for i, (peak_time, peak_price) in enumerate(peak_data):
+        print(f"Peak {i+1}:")
+        print(f"  Time: {peak_time.strftime('%Y-%m-%d %H:%M')}")
+        print(f"  LMP: ${peak_price:.2f}")
+        print()
+
+    print("Load-up Periods:")
+    for i, (start, end, peak) in enumerate(load_up_times):
+        print(f"Load-up {i+1}:")
         print(f"  Start: {start.strftime('%Y-%m-%d %H:%M')}")
         print(f"  End: {end.strftime('%Y-%m-%d %H:%M')}")
-        print(f"  For Peak at: {peak_time.strftime('%Y-%m-%d %H:%M')}")
+        print(f"  For Peak at: {peak.strftime('%Y-%m-%d %H:%M')}")
         print()
 
+    print("Shed Periods:")
+    for i, (start, end, peak) in enumerate(shed_periods):
+        print(f"Shed {i+1}:")
+        print(f"  Start: {start.strftime('%Y-%m-%d %H:%M')}")
+        print(f"  End: {end.strftime('%Y-%m-%d %H:%M')}")
+        print(f"  Duration: {(end - start).total_seconds() / 3600:.2f} hours")
+        print(f"  For Peak at: {peak.strftime('%Y-%m-%d %H:%M')}")
+        print()
+
+    if include_recovery:
+        print("Recovery Load-up Times:")
+        for i, (start, end, peak_time) in enumerate(recovery_times):
+            print(f"Recovery {i+1}:")
+            print(f"  Start: {start.strftime('%Y-%m-%d %H:%M')}")
+            print(f"  End: {end.strftime('%Y-%m-%d %H:%M')}")
+            print(f"  For Peak at: {peak_time.strftime('%Y-%m-%d %H:%M')}")
+            print()
+
 
 # Function to create a list of dictionaries with the required information
 def create_data_for_csv(load_up_times, shed_periods, recovery_times, include_recovery):
@@ -193,24 +239,107 @@ def create_data_for_csv(load_up_times, shed_periods, recovery_times, include_rec
         data.append(row)
     return data
 
-# After all the calculations and user inputs...
-
-# Create the data for the CSV
-csv_data = create_data_for_csv(load_up_times, shed_periods, recovery_times, include_recovery)
-
-# Define the output CSV file path
-#csv_filename = os.path.splitext(os.path.basename(file_path))[0] + '_schedule.csv'
-csv_filename = 'Testing_schedule.csv'
-
-csv_path = os.path.join(os.path.dirname(file_path), csv_filename)
-
-# Write the data to the CSV file
-with open(csv_path, 'w', newline='') as csvfile:
-    fieldnames = ['LU_time', 'LU_duration', 'S_time', 'S_duration', 'RLU_time', 'RLU_duration']
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-    writer.writeheader()
-    for row in csv_data:
-        writer.writerow(row)
-
-print(f"Schedule data saved as: {csv_path}")
+def write_schedule_csv(csv_data, csv_path):
+    # Write the data to the CSV file
+    with open(csv_path, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=SCHEDULE_FIELDS)
+
+        writer.writeheader()
+        for row in csv_data:
+            writer.writerow(row)
+
+    print(f"Schedule data saved as: {csv_path}")
+
+def build_plan(df, plan=None):
+    """
+    Peaks plus load-up, shed and recovery periods, from the plan or from user input
+    """
+    # Identify peaks
+    peak_data = identify_peak_periods(df)
+    if plan:
+        # Peaks the plan has no entry for are left out of the schedule
+        peak_data = [(t, p) for i, (t, p) in enumerate(peak_data) if plan_for_peak(plan, i, t) is not None]
+
+    # Manual input for load-up times
+    load_up_times = manual_load_up_times(df, peak_data, plan)
+
+    # Manual input for shed periods
+    shed_periods = manual_shed_periods(df, peak_data, load_up_times, plan)
+
+    # Manual input for recovery load-up times
+    recovery_times, include_recovery = manual_recovery_load_up_time(shed_periods, plan)
+
+    return peak_data, load_up_times, shed_periods, recovery_times, include_recovery
+
+def plan_file_name(name):
+    return name.replace(' ', '_') + '.png'
+
+def init_worker():
+    plt.switch_backend('Agg')   # batch workers only save plots
+
+def run_plan_day(df, plan, out_dir):
+    """
+    Apply one plan to one DAM day and write its schedule and plot
+    """
+    peak_data, load_up_times, shed_periods, recovery_times, include_recovery = build_plan(df, plan)
+
+    day_dir = os.path.join(out_dir, df['interval_start_utc'].iloc[0].strftime('%Y%m%d'), plan['name'].replace(' ', '_'))
+    os.makedirs(day_dir, exist_ok=True)
+
+    fig = plot_plan(df, peak_data, load_up_times, shed_periods, recovery_times, include_recovery, plan['name'])
+    fig.savefig(os.path.join(day_dir, plan_file_name(plan['name'])), dpi=300)
+    plt.close(fig)
+
+    csv_data = create_data_for_csv(load_up_times, shed_periods, recovery_times, include_recovery)
+    write_schedule_csv(csv_data, os.path.join(day_dir, 'Testing_schedule.csv'))
+    return day_dir
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-up and shed schedule from DAM prices with manual or planned offsets')
+    parser.add_argument('files', nargs='*', default=[file_path], help='DAM csv files (single or multi-day exports)')
+    parser.add_argument('--plan', action='append', help='plan file (json); repeat for several plans')
+    parser.add_argument('--out-dir', default='plans', help='output folder for batch mode')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    if args.plan:
+        plans = []
+        for plan_path in args.plan:
+            with open(plan_path, 'r') as f:
+                plan = json.load(f)
+            plan.setdefault('name', os.path.splitext(os.path.basename(plan_path))[0])
+            plans.append(plan)
+
+        # One job per (day, plan), so a single multi-day export is spread over the workers too
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool:
+            jobs = [(date, plan, pool.submit(run_plan_day, df, plan, args.out_dir))
+                    for path in args.files for date, df in iter_dam_days(path) for plan in plans]
+            for date, plan, future in jobs:
+                try:
+                    future.result()
+                except (KeyError, ValueError) as e:
+                    print(f"Error applying {plan['name']} to {date}: {e}")
+        return
+
+    df = load_dam_day(args.files[0])
+    peak_data, load_up_times, shed_periods, recovery_times, include_recovery = build_plan(df)
+
+    # Visualization
+    plot_plan(df, peak_data, load_up_times, shed_periods, recovery_times, include_recovery, 'Plan E')
+    plt.savefig('/content/drive/MyDrive/PSU/GoogleColab/GridStatus/Plan_E.png',dpi=300)
+    plt.show()
+
+    print_plan(peak_data, load_up_times, shed_periods, recovery_times, include_recovery)
+
+    # Create the data for the CSV
+    csv_data = create_data_for_csv(load_up_times, shed_periods, recovery_times, include_recovery)
+
+    # Define the output CSV file path
+    #csv_filename = os.path.splitext(os.path.basename(file_path))[0] + '_schedule.csv'
+    csv_filename = 'Testing_schedule.csv'
+
+    csv_path = os.path.join(os.path.dirname(args.files[0]), csv_filename)
+    write_schedule_csv(csv_data, csv_path)
+
+if __name__ == "__main__":
+    main()
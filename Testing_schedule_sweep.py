@@ -0,0 +1,214 @@
+# Parameter sweep for the peak detection in Testing_schedule.py
+# Evaluates a grid of identify_period_peaks tuning constants over a set of
+# historical DAM days in parallel and writes one row of metrics per grid
+# point: peaks found, evening fallback rate, schedule cost and (optionally)
+# agreement with a labelled set of peak times.
+#
+# Example:
+#   python Testing_schedule_sweep.py DAM*.csv --prominence 0.04,0.06,0.08,0.1 \
+#       --distance 2,3,4,6 --labels peak_labels.csv --output sweep.csv
+#
+# The labelled set is a csv with one peak per line: date,peak_time
+# (YYYY-MM-DD,HH:MM).
+
+import argparse
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from Testing_schedule import compute_schedule
+from DAM_ingest import iter_dam_days
+
+# Flat heater load used to price a schedule (kW). Shed avoids this load and
+# the same energy is bought back evenly during the load-up of the period.
+BASE_LOAD_KW = 1.0
+LABEL_TOLERANCE = pd.Timedelta(hours=1)
+
+OUTPUT_FIELDS = ['prominence_threshold', 'evening_prominence', 'distance', 'width', 'height_std',
+                 'fallback_hours', 'days', 'failed_days', 'peaks_per_day', 'no_morning_peak_rate', 'fallback_rate',
+                 'shed_hours_per_day', 'cost_per_day', 'label_recall', 'label_precision', 'first_failure']
+
+# Errors compute_schedule raises on days with missing data (e.g. a partial first
+# or last day of an export); anything else is a bug and ends the sweep
+DAY_ERRORS = (IndexError, ValueError, KeyError)
+
+# Filled once per worker process by init_worker, so the price data is sent
+# to each worker once instead of once per grid point
+_days = []
+_labels = {}
+
+def init_worker(days, labels):
+    global _days, _labels
+    _days = days
+    _labels = labels
+
+def naive(t):
+    """
+    Local wall clock time without the timezone
+    """
+    t = pd.Timestamp(t)
+    return t.tz_localize(None) if t.tzinfo is not None else t
+
+def as_np(t):
+    return np.datetime64(naive(t), 'ns')
+
+def interval_hours(times):
+    """
+    Length of each price interval in hours (the last one repeats the previous step)
+    """
+    steps = np.diff(times.astype('datetime64[s]').astype(np.int64)) / 3600
+    if len(steps) == 0:
+        return np.ones(len(times))
+    return np.append(steps, steps[-1])
+
+def schedule_cost(times, lmp, result):
+    """
+    Cost change against a flat BASE_LOAD_KW load, $ per day (negative is a saving)
+    """
+    hours = interval_hours(times)
+    delta_kw = np.zeros(len(times))
+    for loadups, sheds in [(result['morning_loadup'], result['morning_shed']),
+                           (result['evening_loadup'], result['evening_shed'])]:
+        for shed_start, shed_end, _ in sheds:
+            in_shed = (times >= as_np(shed_start)) & (times < as_np(shed_end))
+            shed_energy = BASE_LOAD_KW * hours[in_shed].sum()
+            delta_kw[in_shed] -= BASE_LOAD_KW
+            if loadups:
+                lu_start, lu_end, _ = loadups[0]
+                window = (times >= as_np(lu_start)) & (times < as_np(lu_end))
+            else:
+                # No load-up: the heater recovers right after the shed
+                window = (times >= as_np(shed_end)) & \
+                         (times < as_np(shed_end) + (as_np(shed_end) - as_np(shed_start)))
+            window_hours = hours[window].sum()
+            if window_hours > 0:
+                delta_kw[window] += shed_energy / window_hours
+    return float(np.sum(delta_kw * hours * lmp) / 1000)    # LMP is $/MWh
+
+def evaluate_point(params):
+    peaks = 0
+    no_morning = 0
+    fallbacks = 0
+    shed_hours = 0.0
+    cost = 0.0
+    labelled = matched_labels = detected = matched_detected = 0
+    failed = 0
+    first_failure = ''
+
+    for date, df, times, lmp in _days:
+        # A day the scheduler cannot handle is counted as failed instead of ending the whole sweep
+        try:
+            result = compute_schedule(df, **params)
+        except DAY_ERRORS as e:
+            failed += 1
+            if not first_failure:
+                first_failure = f"{date} {type(e).__name__}: {e}"
+            continue
+        found = result['morning_peaks'] + result['evening_peaks']
+        peaks += len(found)
+        no_morning += not result['morning_peaks']
+        fallbacks += result['evening_fallback']
+        shed_hours += sum((end - start).total_seconds() / 3600
+                          for start, end, _ in result['morning_shed'] + result['evening_shed'])
+        cost += schedule_cost(times, lmp, result)
+
+        if date in _labels:
+            found_times = [naive(t) for t, _ in found]
+            labels = _labels[date]
+            labelled += len(labels)
+            matched_labels += sum(any(abs(t - label) <= LABEL_TOLERANCE for t in found_times) for label in labels)
+            detected += len(found_times)
+            matched_detected += sum(any(abs(t - label) <= LABEL_TOLERANCE for label in labels) for t in found_times)
+
+    n = max(len(_days) - failed, 1)
+    row = dict(params, fallback_hours='-'.join(map(str, params['fallback_hours'])))
+    row.update({
+        'days': len(_days) - failed,
+        'failed_days': failed,
+        'peaks_per_day': round(peaks / n, 3),
+        'no_morning_peak_rate': round(no_morning / n, 3),
+        'fallback_rate': round(fallbacks / n, 3),
+        'shed_hours_per_day': round(shed_hours / n, 3),
+        'cost_per_day': round(cost / n, 4),
+        'label_recall': round(matched_labels / labelled, 3) if labelled else '',
+        'label_precision': round(matched_detected / detected, 3) if detected else '',
+        'first_failure': first_failure,
+    })
+    return row
+
+def load_days(paths):
+    days = []
+    for path in paths:
+        for date, df in iter_dam_days(path):
+            times = df['interval_start_utc'].dt.tz_localize(None).to_numpy().astype('datetime64[ns]')
+            days.append((date, df, times, df['lmp'].to_numpy()))
+    return days
+
+def load_labels(path):
+    labels = {}
+    if not path:
+        return labels
+    with open(path, 'r') as f:
+        for row in csv.reader(f):
+            try:
+                peak = datetime.strptime(f'{row[0]} {row[1]}', '%Y-%m-%d %H:%M')
+            except (IndexError, ValueError):
+                continue    # header line
+            labels.setdefault(peak.date(), []).append(pd.Timestamp(peak))
+    return labels
+
+def parse_list(text, cast):
+    return [cast(value) for value in text.split(',')]
+
+def parse_hours(text):
+    return [tuple(int(h) for h in pair.split('-')) for pair in text.split(',')]
+
+def main():
+    parser = argparse.ArgumentParser(description='Grid search over the peak detection parameters')
+    parser.add_argument('files', nargs='+', help='DAM csv files (single or multi-day exports)')
+    parser.add_argument('--prominence', default='0.08', help='comma separated prominence thresholds')
+    parser.add_argument('--evening-prominence', default='0.05')
+    parser.add_argument('--distance', default='4')
+    parser.add_argument('--width', default='1')
+    parser.add_argument('--height-std', default='0.25', help='height = mean - height_std * std')
+    parser.add_argument('--fallback-hours', default='17-19', help='evening fallback windows, e.g. 17-19,16-20')
+    parser.add_argument('--labels', help='labelled peak times (date,peak_time)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default='Testing_schedule_sweep.csv')
+    args = parser.parse_args()
+
+    grid = [
+        {'prominence_threshold': p, 'evening_prominence': ep, 'distance': d, 'width': w,
+         'height_std': hs, 'fallback_hours': fh}
+        for p, ep, d, w, hs, fh in itertools.product(
+            parse_list(args.prominence, float), parse_list(args.evening_prominence, float),
+            parse_list(args.distance, int), parse_list(args.width, int),
+            parse_list(args.height_std, float), parse_hours(args.fallback_hours))
+    ]
+
+    days = load_days(args.files)
+    labels = load_labels(args.labels)
+    print(f"Evaluating {len(grid)} parameter sets over {len(days)} days with {args.workers} workers...")
+
+    with open(args.output, 'w', newline='') as out, \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                                initargs=(days, labels)) as pool:
+        writer = csv.DictWriter(out, fieldnames=OUTPUT_FIELDS)
+        writer.writeheader()
+        chunksize = max(1, len(grid) // (4 * args.workers))
+        for row in pool.map(evaluate_point, grid, chunksize=chunksize):
+            writer.writerow(row)
+            if row['failed_days']:
+                print(f"Warning: {row['failed_days']} days failed for prominence {row['prominence_threshold']}, "
+                      f"distance {row['distance']}, fallback {row['fallback_hours']} "
+                      f"(first: {row['first_failure']})")
+
+    print(f"Sweep results saved as: {args.output}")
+
+if __name__ == "__main__":
+    main()
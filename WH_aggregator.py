@@ -0,0 +1,225 @@
+# Streaming per-minute / per-hour summaries of a running test
+# The runners feed every commodity log row they copy (with the command in
+# effect) and the draw controller feeds every draw it logs. Only the open
+# period of each resolution is kept in memory; when a period closes, one
+# line is appended to its summary file, e.g.
+#   WH_summary_minute.csv / WH_summary_hour.csv       (WH_testing_1P/2P)
+#   WH_Draw_summary_minute.csv / ..._hour.csv         (DrawController_FM)
+# Dashboards and daily reports can read these instead of the raw logs.
+#
+# state()/restore() let the runners keep the open periods and the summary
+# file sizes in their checkpoint, so a resumed test does not write a
+# period twice.
+
+import os
+import threading
+from datetime import datetime, timedelta
+
+from WH_log_storage import COMMODITY_COLUMNS, parse_log_time
+
+# Resolution name -> period length in seconds
+SUMMARY_PERIODS = {'minute': 60, 'hour': 3600}
+
+# Commodity log columns used by the summary (see COMMODITY_COLUMNS)
+POWER_COLUMN = 'Power'
+ENERGY_COLUMN = 'Cumulative Energy'
+STATE_COLUMNS = ['Energy Take Capacity', 'Total Energy Storage Capacity']
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _fmt(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return f'{value:.6g}'
+    return str(value)
+
+class _PeriodSummary:
+    """
+    Fixed-period aggregation into one summary file per resolution
+    """
+    fields = []
+
+    def __init__(self, prefix, periods=SUMMARY_PERIODS):
+        self.periods = periods
+        self.files = {name: f'{prefix}_{name}.csv' for name in periods}
+        self.open = {name: None for name in periods}     # [period start, accumulator]
+        self.closed_until = {name: None for name in periods}
+        self.lock = threading.Lock()
+        for filename in self.files.values():
+            if not os.path.isfile(filename):
+                with open(filename, 'w') as f:
+                    f.write(','.join(['period_start'] + self.fields) + '\n')
+
+    def _period_start(self, name, t):
+        seconds = self.periods[name]
+        since_midnight = t.hour * 3600 + t.minute * 60 + t.second
+        return t.replace(microsecond=0) - timedelta(seconds=since_midnight % seconds)
+
+    def _accumulator(self, name, t):
+        """
+        Accumulator of the period holding t, closing the open period if t is past it
+        """
+        # Late events (before a period already written) count in the next open period
+        if self.closed_until[name] is not None and t < self.closed_until[name]:
+            t = self.closed_until[name]
+        start = self._period_start(name, t)
+        if self.open[name] is not None and self.open[name][0] != start:
+            self._close(name)
+        if self.open[name] is None:
+            self.open[name] = [start, self._new()]
+        return self.open[name][1]
+
+    def _close(self, name):
+        start, acc = self.open[name]
+        with open(self.files[name], 'a') as f:
+            f.write(','.join([start.strftime('%Y-%m-%d %H:%M:%S')] + [_fmt(v) for v in self._row(acc)]) + '\n')
+        self.open[name] = None
+        self.closed_until[name] = start + timedelta(seconds=self.periods[name])
+
+    def tick(self, now):
+        """
+        Write the periods that ended before now
+        """
+        with self.lock:
+            for name, period in self.open.items():
+                if period is not None and now >= period[0] + timedelta(seconds=self.periods[name]):
+                    self._close(name)
+
+    def close(self):
+        """
+        Write the open periods (end of test)
+        """
+        with self.lock:
+            for name in self.periods:
+                if self.open[name] is not None:
+                    self._close(name)
+
+    def state(self):
+        """
+        JSON-serializable open periods and summary file sizes, for the checkpoint
+        """
+        with self.lock:
+            return {
+                name: {
+                    'size': os.path.getsize(self.files[name]),
+                    'open': [self.open[name][0].isoformat(), self.open[name][1]] if self.open[name] else None,
+                    'closed_until': self.closed_until[name].isoformat() if self.closed_until[name] else None,
+                }
+                for name in self.periods
+            }
+
+    def restore(self, state):
+        """
+        Go back to a state() saved in a checkpoint, dropping summary lines written after it
+        """
+        with self.lock:
+            for name, saved in (state or {}).items():
+                if name not in self.periods:
+                    continue
+                with open(self.files[name], 'r+b') as f:
+                    f.truncate(saved['size'])
+                self.open[name] = [datetime.fromisoformat(saved['open'][0]), saved['open'][1]] if saved['open'] else None
+                self.closed_until[name] = datetime.fromisoformat(saved['closed_until']) if saved['closed_until'] else None
+
+class CommoditySummary(_PeriodSummary):
+    """
+    Summary of the commodity log rows: power, energy used, storage state and commands
+    """
+    fields = ['rows', 'power_mean', 'power_min', 'power_max', 'energy',
+              'take_capacity_min', 'take_capacity_last', 'storage_capacity_last', 'commands']
+
+    def __init__(self, prefix='WH_summary', periods=SUMMARY_PERIODS, columns=COMMODITY_COLUMNS):
+        super().__init__(prefix, periods)
+        self.power_col = columns.index(POWER_COLUMN)
+        self.energy_col = columns.index(ENERGY_COLUMN)
+        self.state_cols = [columns.index(c) for c in STATE_COLUMNS]
+        self.last_energy = None     # energy of the previous row, so no energy is lost between periods
+
+    def _new(self):
+        return {'rows': 0, 'power_sum': 0.0, 'power_min': None, 'power_max': None,
+                'energy_first': None, 'energy_last': None, 'take_min': None, 'take_last': None,
+                'storage_last': None, 'commands': []}
+
+    def add_rows(self, rows, command=None):
+        """
+        Add commodity log rows (lists of strings, time first) sent while `command` was in effect
+        """
+        with self.lock:
+            for row in rows:
+                try:
+                    t = parse_log_time(row[0])
+                except (IndexError, ValueError):
+                    continue
+                power = _to_float(row[self.power_col]) if len(row) > self.power_col else None
+                energy = _to_float(row[self.energy_col]) if len(row) > self.energy_col else None
+                take, storage = [_to_float(row[c]) if len(row) > c else None for c in self.state_cols]
+                previous_energy = self.last_energy if self.last_energy is not None else energy
+
+                for name in self.periods:
+                    acc = self._accumulator(name, t)
+                    acc['rows'] += 1
+                    if power is not None:
+                        acc['power_sum'] += power
+                        acc['power_min'] = power if acc['power_min'] is None else min(acc['power_min'], power)
+                        acc['power_max'] = power if acc['power_max'] is None else max(acc['power_max'], power)
+                    if energy is not None:
+                        if acc['energy_first'] is None:
+                            acc['energy_first'] = previous_energy
+                        acc['energy_last'] = energy
+                    if take is not None:
+                        acc['take_min'] = take if acc['take_min'] is None else min(acc['take_min'], take)
+                        acc['take_last'] = take
+                    if storage is not None:
+                        acc['storage_last'] = storage
+                    if command and command not in acc['commands']:
+                        acc['commands'].append(command)
+                if energy is not None:
+                    self.last_energy = energy
+
+    def state(self):
+        state = super().state()
+        state['last_energy'] = self.last_energy
+        return state
+
+    def restore(self, state):
+        super().restore(state)
+        self.last_energy = (state or {}).get('last_energy')
+
+    def _row(self, acc):
+        energy = None
+        if acc['energy_first'] is not None:
+            energy = acc['energy_last'] - acc['energy_first']
+        return [acc['rows'], acc['power_sum'] / acc['rows'] if acc['rows'] else None,
+                acc['power_min'], acc['power_max'], energy, acc['take_min'], acc['take_last'],
+                acc['storage_last'], '/'.join(acc['commands'])]
+
+class DrawSummary(_PeriodSummary):
+    """
+    Summary of the draws of one rig: count, volume and time spent drawing
+    """
+    fields = ['draws', 'volume_gal', 'duration_s', 'max_volume_gal', 'target_gal']
+
+    def __init__(self, prefix='WH_Draw_summary', periods=SUMMARY_PERIODS):
+        super().__init__(prefix, periods)
+
+    def _new(self):
+        return {'draws': 0, 'volume': 0.0, 'duration': 0.0, 'max_volume': 0.0, 'target': 0.0}
+
+    def add_draw(self, t, volume, duration, target=None):
+        with self.lock:
+            for name in self.periods:
+                acc = self._accumulator(name, t)
+                acc['draws'] += 1
+                acc['volume'] += volume
+                acc['duration'] += duration
+                acc['max_volume'] = max(acc['max_volume'], volume)
+                acc['target'] += target if target is not None else volume
+
+    def _row(self, acc):
+        return [acc['draws'], round(acc['volume'], 3), round(acc['duration'], 2),
+                round(acc['max_volume'], 3), round(acc['target'], 3)]
@@ -0,0 +1,260 @@
+# Post-test analytics
+# Joins the commodity log (output.csv from WH_testing), the draw logs
+# (WH_Data_M-D-YYYY.csv from DrawController_FM.py, or the
+# WH_Data_<name>_M-D-YYYY.csv of every rig, see --rig), the testing schedules
+# and the day ahead market prices, and computes per-period metrics for
+# every test day found in the commodity log.
+# The commodity log is read in chunks and processed one day at a time,
+# so months of logs can be analyzed without loading them whole.
+
+import argparse
+import csv
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from WH_log_storage import COMMODITY_COLUMNS, iter_segments, parse_log_times
+from DAM_ingest import load_dam_day
+from Schedule_compile import compile_schedule, ScheduleError
+
+# output.csv has no header line (update_csv skips the first row of log.csv),
+# so the column names come from COMMODITY_COLUMNS in WH_log_storage.py
+LOG_TIME_COL = 'Time'
+LOG_POWER_COL = 'Power'     # instantaneous power (W)
+
+CHUNK_ROWS = 100000
+
+OUTPUT_FIELDS = ['date', 'period', 'command', 'start', 'end', 'duration_h', 'energy_kWh',
+                 'avg_power_W', 'baseline_power_W', 'energy_shifted_kWh', 'energy_avoided_kWh',
+                 'draw_gal', 'draw_events', 'avg_lmp', 'cost']
+
+def split_days(chunks):
+    """
+    Regroup a stream of time-ordered chunks into (date, DataFrame) per test day
+    """
+    carry = None
+    for chunk in chunks:
+        chunk = chunk.dropna(subset=[LOG_TIME_COL])
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if chunk.empty:
+            continue
+
+        dates = chunk[LOG_TIME_COL].dt.date
+        last_date = dates.iloc[-1]
+        # Rows of the last date may continue in the next chunk
+        done = chunk[dates != last_date]
+        carry = chunk[dates == last_date]
+        for date, day_df in done.groupby(dates[dates != last_date], sort=True):
+            yield date, day_df
+
+    if carry is not None and not carry.empty:
+        yield carry[LOG_TIME_COL].iloc[0].date(), carry
+
+def iter_commodity_chunks(log_file, chunksize=CHUNK_ROWS):
+    """
+    Stream output.csv in chunks of typed rows
+    """
+    reader = pd.read_csv(log_file, names=COMMODITY_COLUMNS, header=None, chunksize=chunksize,
+                         on_bad_lines='skip')
+    for chunk in reader:
+        chunk[LOG_TIME_COL] = parse_log_times(chunk[LOG_TIME_COL], errors='coerce')
+        chunk[LOG_POWER_COL] = pd.to_numeric(chunk[LOG_POWER_COL], errors='coerce')
+        yield chunk
+
+def schedule_file_for(schedule_dir, date):
+    """
+    Prefer the per-day Schedule_YYYYMMDD.csv, fall back to Testing_schedule.csv
+    """
+    day_file = os.path.join(schedule_dir, f"Schedule_{date.strftime('%Y%m%d')}.csv")
+    if os.path.isfile(day_file):
+        return day_file
+    default_file = os.path.join(schedule_dir, 'Testing_schedule.csv')
+    if os.path.isfile(default_file):
+        return default_file
+    return None
+
+def read_schedule_periods(schedule_file, date):
+    """
+    Read a testing schedule into a DataFrame of (period, command, start, end) for the given day
+    """
+    timeline = compile_schedule(schedule_file)     # same validation and midnight wrap as the runners
+    midnight = pd.Timestamp(date)
+    df = pd.DataFrame(timeline['periods'], columns=['period', 'command', 'start', 'end', 'row'])
+    # Schedules with one row per peak (Testing_schedule_Manual.py) repeat the period
+    # names, so they are numbered by row: LU1, S1, RLU1, LU2, ...
+    if df['row'].nunique() > 1:
+        df['period'] = df['period'] + df['row'].astype(str)
+    df = df.drop(columns='row')
+    df['start'] = (midnight + pd.to_timedelta(df['start'], unit='s')).astype('datetime64[ns]')
+    df['end'] = (midnight + pd.to_timedelta(df['end'], unit='s')).astype('datetime64[ns]')
+    return df
+
+def draw_log_files(draw_dir, date, rig=None):
+    """
+    Draw logs of the given day: WH_Data_M-D-YYYY.csv of a single rig setup and the
+    WH_Data_<name>_M-D-YYYY.csv of every rig (or only of `rig`) of a multi-rig setup
+    """
+    date_str = f'{date.month}-{date.day}-{date.year}'
+    if rig:
+        return [os.path.join(draw_dir, f'WH_Data_{rig}_{date_str}.csv')]
+    return [os.path.join(draw_dir, f'WH_Data_{date_str}.csv')] + \
+        sorted(glob.glob(os.path.join(draw_dir, f'WH_Data_*_{date_str}.csv')))
+
+def read_draw_log(draw_dir, date, rig=None):
+    """
+    Read the day's draw logs (see draw_log_files), empty frame if there are none
+    """
+    frames = []
+    for filename in draw_log_files(draw_dir, date, rig):
+        if not os.path.isfile(filename):
+            continue
+        draws = pd.read_csv(filename)
+        draws['time'] = pd.to_datetime(date.isoformat() + ' ' + draws['Time'], format='%Y-%m-%d %H:%M:%S',
+                                       errors='coerce')
+        draws['draw_gal'] = pd.to_numeric(draws['Draw Amount'], errors='coerce')
+        frames.append(draws.dropna(subset=['time'])[['time', 'draw_gal']])
+    if not frames:
+        return pd.DataFrame({'time': pd.Series(dtype='datetime64[ns]'), 'draw_gal': pd.Series(dtype=float)})
+    return pd.concat(frames, ignore_index=True).sort_values('time', kind='stable')
+
+def read_day_prices(dam_dir, date):
+    """
+    Read the day's DAM prices (DAMMMDDYYYY.csv) as (time, lmp), empty frame if missing
+    """
+    filename = os.path.join(dam_dir, f"DAM{date.strftime('%m%d%Y')}.csv")
+    if not os.path.isfile(filename):
+        return pd.DataFrame({'time': pd.Series(dtype='datetime64[ns]'), 'lmp': pd.Series(dtype=float)})
+    prices = load_dam_day(filename)
+    # Local wall clock time, as in the commodity log
+    prices['time'] = prices['interval_start_utc'].dt.tz_localize(None).astype('datetime64[ns]')
+    return prices[['time', 'lmp']].sort_values('time')
+
+def label_periods(times, periods):
+    """
+    As-of join of sorted times onto schedule periods; times outside every period are 'baseline'
+    """
+    left = pd.DataFrame({'time': times.to_numpy().astype('datetime64[ns]')})
+    if periods.empty:
+        left['period'] = 'baseline'
+        left['command'] = 'e'
+        return left
+    joined = pd.merge_asof(left, periods, left_on='time', right_on='start', direction='backward')
+    outside = joined['start'].isna() | (joined['time'] >= joined['end'])
+    joined.loc[outside, 'period'] = 'baseline'
+    joined.loc[outside, 'command'] = 'e'
+    return joined[['time', 'period', 'command']]
+
+def analyze_day(date, log_df, periods, draws, prices):
+    """
+    Per-period energy, draw volume and cost for one test day
+    """
+    log_df = log_df.sort_values(LOG_TIME_COL)
+    times = log_df[LOG_TIME_COL]
+    power = log_df[LOG_POWER_COL].fillna(0).to_numpy()
+
+    # Energy of each sample: power held until the next sample
+    dt_h = np.diff(times.to_numpy()).astype('timedelta64[ms]').astype(float) / 3.6e6
+    dt_h = np.append(dt_h, 0.0)
+    energy_kWh = power * dt_h / 1000
+
+    rows = label_periods(times, periods)
+    rows['energy_kWh'] = energy_kWh
+    rows['dt_h'] = dt_h
+
+    if not prices.empty:
+        lmp = pd.merge_asof(rows[['time']], prices, on='time', direction='backward')['lmp']
+        rows['cost'] = rows['energy_kWh'] * lmp.to_numpy() / 1000    # LMP is $/MWh
+        rows['lmp'] = lmp.to_numpy()
+    else:
+        rows['cost'] = np.nan
+        rows['lmp'] = np.nan
+
+    draw_rows = label_periods(draws['time'], periods)
+    draw_rows['draw_gal'] = draws['draw_gal'].to_numpy()
+
+    baseline = rows[rows['period'] == 'baseline']
+    baseline_h = baseline['dt_h'].sum()
+    baseline_power = baseline['energy_kWh'].sum() * 1000 / baseline_h if baseline_h > 0 else np.nan
+
+    results = []
+    bounds = periods.set_index('period') if not periods.empty else None
+    for (period, command), group in rows.groupby(['period', 'command'], sort=False):
+        duration_h = group['dt_h'].sum()
+        energy = group['energy_kWh'].sum()
+        expected = baseline_power * duration_h / 1000
+        period_draws = draw_rows[draw_rows['period'] == period]['draw_gal']
+        if bounds is not None and period in bounds.index:
+            start, end = bounds.loc[period, 'start'], bounds.loc[period, 'end']
+        else:
+            start, end = group['time'].min(), group['time'].max()
+        results.append({
+            'date': date.isoformat(),
+            'period': period,
+            'command': command,
+            'start': start.strftime('%Y-%m-%d %H:%M'),
+            'end': end.strftime('%Y-%m-%d %H:%M'),
+            'duration_h': round(duration_h, 3),
+            'energy_kWh': round(energy, 4),
+            'avg_power_W': round(energy * 1000 / duration_h, 1) if duration_h > 0 else '',
+            'baseline_power_W': round(baseline_power, 1) if not np.isnan(baseline_power) else '',
+            'energy_shifted_kWh': round(energy - expected, 4) if command == 'l' and not np.isnan(expected) else '',
+            'energy_avoided_kWh': round(expected - energy, 4) if command == 's' and not np.isnan(expected) else '',
+            'draw_gal': round(period_draws.sum(), 2),
+            'draw_events': int(period_draws.count()),
+            'avg_lmp': round(group['lmp'].mean(), 2) if group['lmp'].notna().any() else '',
+            'cost': round(group['cost'].sum(), 4) if group['cost'].notna().any() else '',
+        })
+    return results
+
+def run_analytics(log_file, schedule_dir, draw_dir, dam_dir, output_file, chunksize=CHUNK_ROWS, store_dir=None,
+                  rig=None):
+    if store_dir:
+        chunks = iter_segments(store_dir)    # columnar store, see LOG_STORAGE_DIR in WH_testing
+    else:
+        chunks = iter_commodity_chunks(log_file, chunksize)
+
+    with open(output_file, 'w', newline='') as out:
+        writer = csv.DictWriter(out, fieldnames=OUTPUT_FIELDS)
+        writer.writeheader()
+        for date, log_df in split_days(chunks):
+            schedule_file = schedule_file_for(schedule_dir, date)
+            periods = None
+            if schedule_file:
+                try:
+                    periods = read_schedule_periods(schedule_file, date)
+                except ScheduleError as e:
+                    print(f"Warning: invalid schedule for {date} ({e}), treating the day as baseline")
+            else:
+                print(f"Warning: no schedule found for {date}, treating the day as baseline")
+            if periods is None:
+                periods = pd.DataFrame(columns=['period', 'command', 'start', 'end'])
+            draws = read_draw_log(draw_dir, date, rig)
+            prices = read_day_prices(dam_dir, date)
+
+            results = analyze_day(date, log_df, periods, draws, prices)
+            writer.writerows(results)
+            out.flush()
+            print(f"{date}: {len(log_df)} log rows, {len(draws)} draws, {len(results)} periods")
+
+    print(f"Analytics saved as: {output_file}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-period metrics for water heater test days')
+    parser.add_argument('--log', default='output.csv', help='commodity log written by WH_testing')
+    parser.add_argument('--store', help='columnar log store folder, used instead of --log')
+    parser.add_argument('--schedules', default='.', help='folder with Schedule_YYYYMMDD.csv / Testing_schedule.csv')
+    parser.add_argument('--draws', default='.', help='folder with WH_Data_M-D-YYYY.csv draw logs')
+    parser.add_argument('--rig', help='only the draw log of this rig (WH_Data_<rig>_M-D-YYYY.csv); default: all rigs')
+    parser.add_argument('--dam', default='.', help='folder with DAMMMDDYYYY.csv price files')
+    parser.add_argument('--output', default='WH_analytics.csv')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    run_analytics(args.log, args.schedules, args.draws, args.dam, args.output, args.chunksize, args.store,
+                  args.rig)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# Crash-safe checkpoints for WH_testing_1P.py / WH_testing_2P.py
+# The runner state (log.csv byte offset, output size, schedule, test end
+# time, last command sent) is written atomically after every copy cycle,
+# so a crashed or rebooted test can resume without recopying data.
+
+import json
+import os
+from datetime import datetime
+
+CHECKPOINT_FILE = 'WH_testing_checkpoint.json'
+
+def save_checkpoint(state, path=CHECKPOINT_FILE):
+    """
+    Atomically replace the checkpoint file with the given state
+    """
+    state = dict(state)
+    state['saved_at'] = datetime.now().isoformat()
+    state['end_time'] = state['end_time'].isoformat()
+    state['schedule'] = [dict(item, start=item['start'].isoformat()) for item in state['schedule']]
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    # Make the rename itself durable across a power loss
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def load_checkpoint(path=CHECKPOINT_FILE):
+    """
+    Return the saved state, or None if there is no usable checkpoint
+    """
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+        state['end_time'] = datetime.fromisoformat(state['end_time'])
+        state['schedule'] = [dict(item, start=datetime.fromisoformat(item['start'])) for item in state['schedule']]
+        return state
+    except (ValueError, KeyError) as e:
+        print(f"Error reading checkpoint: {e}")
+        return None
+
+def clear_checkpoint(path=CHECKPOINT_FILE):
+    if os.path.isfile(path):
+        os.remove(path)
@@ -0,0 +1,40 @@
+# Clocks used by WH_testing_1P.py / WH_testing_2P.py and DrawController_FM.py
+# WallClock is the real time used on the test rigs. VirtualClock is used by
+# WH_simulation.py: sleeping advances the virtual time immediately, so a
+# full test day can be replayed in seconds.
+
+import time
+from datetime import datetime, timedelta
+
+class WallClock:
+    def now(self):
+        return datetime.now()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+class VirtualClock:
+    """
+    Clock that only moves when something sleeps on it
+    """
+    def __init__(self, start):
+        self.current = start
+        self.listeners = []     # called with (old, new) every time the clock moves
+
+    def now(self):
+        return self.current
+
+    def time(self):
+        return self.current.timestamp()
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        old = self.current
+        self.current = old + timedelta(seconds=seconds)
+        for listener in self.listeners:
+            listener(old, self.current)
@@ -0,0 +1,216 @@
+# Columnar storage for the commodity log
+# Rows copied from log.csv are stored as typed, compressed NumPy column
+# segments (.npz files, like Parquet row groups) instead of raw text lines
+# in output.csv. index.csv keeps the time range of every segment so a
+# reader only loads the segments it needs.
+# Rows are buffered until ROWS_PER_SEGMENT rows or a new day, so segments
+# stay large. The buffered rows are only in log.csv until then: the
+# runners keep the log.csv position of the first buffered row in their
+# checkpoint (buffer_start) and copy them again on resume.
+#
+# Layout of a store directory:
+#   index.csv                 segment,t_min,t_max,rows
+#   seg_000000.npz            'time' (datetime64[ms]) + one float64 array per column
+
+import csv
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Column layout of the commodity log written by sample2.
+# The first column is the timestamp, the others are numeric.
+# Adjust to match the sample2 build in use.
+COMMODITY_COLUMNS = ['Time', 'Power', 'Cumulative Energy', 'Energy Take Capacity', 'Total Energy Storage Capacity']
+
+# Accepted formats of the commodity log timestamp, tried in order. Every
+# reader of the log (this store, WH_aggregator.py, WH_analytics.py) parses
+# times with parse_log_time/parse_log_times so they agree on what is valid.
+LOG_TIME_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%d %H:%M',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+]
+
+ROWS_PER_SEGMENT = 50000
+INDEX_FILE = 'index.csv'
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def parse_log_time(value):
+    """
+    Parse one commodity log timestamp, ValueError if it matches none of LOG_TIME_FORMATS
+    """
+    text = str(value).strip()
+    for fmt in LOG_TIME_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognized log time {text!r} (add its format to LOG_TIME_FORMATS)")
+
+def _row_day(row):
+    try:
+        return parse_log_time(row[0]).date()
+    except (IndexError, ValueError):
+        return None
+
+def parse_log_times(values, errors='raise'):
+    """
+    Parse a column of commodity log timestamps into datetime64[ns].
+    errors='raise' raises ValueError on the first unparseable time, 'coerce' gives NaT.
+    """
+    text = pd.Series(values, dtype=object).astype(str).str.strip().reset_index(drop=True)
+    result = pd.Series(pd.NaT, index=text.index, dtype='datetime64[ns]')
+    remaining = pd.Series(True, index=text.index)
+    for fmt in LOG_TIME_FORMATS:
+        if not remaining.any():
+            break
+        parsed = pd.to_datetime(text[remaining], format=fmt, errors='coerce')
+        result[remaining] = parsed
+        remaining &= result.isna()
+    if errors == 'raise' and remaining.any():
+        parse_log_time(text[remaining].iloc[0])     # raises with the offending value
+    return result.to_numpy()
+
+class ColumnarLog:
+    """
+    Append-only writer for a columnar commodity log store
+    """
+    def __init__(self, directory, columns=COMMODITY_COLUMNS, rows_per_segment=ROWS_PER_SEGMENT):
+        self.directory = directory
+        self.columns = columns
+        self.rows_per_segment = rows_per_segment
+        self.buffer = []
+        self.buffer_start = None    # caller's position (log.csv offset) of the first buffered row
+        os.makedirs(directory, exist_ok=True)
+
+        index_path = os.path.join(directory, INDEX_FILE)
+        if not os.path.isfile(index_path):
+            with open(index_path, 'w', newline='') as index:
+                csv.writer(index).writerow(['segment', 't_min', 't_max', 'rows'])
+        self.next_segment = len(read_index(directory))
+
+    def append_rows(self, rows, position=None):
+        """
+        Buffer rows read from `position` of the source; the buffer is written out when it
+        reaches rows_per_segment rows or the rows start a new day
+        """
+        if not rows:
+            return
+        if self.buffer and _row_day(rows[0]) not in (None, _row_day(self.buffer[0])):
+            self.flush()
+        if not self.buffer:
+            self.buffer_start = position
+        self.buffer.extend(rows)
+        # The whole buffer is written, so a new buffer always starts at an append position
+        if len(self.buffer) >= self.rows_per_segment:
+            self.flush()
+
+    def flush(self):
+        for i in range(0, len(self.buffer), self.rows_per_segment):
+            self._write_segment(self.buffer[i:i + self.rows_per_segment])
+        self.buffer = []
+        self.buffer_start = None
+
+    def rollback(self, segments):
+        """
+        Drop index entries past the first `segments` (e.g. written after the last checkpoint)
+        """
+        self.buffer = []
+        self.buffer_start = None
+        entries = read_index(self.directory)[:segments]
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        with open(index_path + '.tmp', 'w', newline='') as index:
+            writer = csv.writer(index)
+            writer.writerow(['segment', 't_min', 't_max', 'rows'])
+            for entry in entries:
+                writer.writerow([entry['segment'], entry['t_min'], entry['t_max'], entry['rows']])
+        os.replace(index_path + '.tmp', index_path)
+        self.next_segment = len(entries)
+
+    def _write_segment(self, rows):
+        ncols = len(self.columns)
+        rows = [row + [''] * (ncols - len(row)) for row in rows]
+        raw_times = [row[0] for row in rows]
+        arrays = {'time': parse_log_times(raw_times, errors='coerce').astype('datetime64[ms]')}
+        bad = np.isnat(arrays['time'])
+        if bad.any():
+            # Keep the text so the rows are not lost, and say so
+            arrays['time_raw'] = np.array(raw_times, dtype=str)
+            print(f"Warning: {bad.sum()} log rows with unrecognized times (e.g. {raw_times[int(np.argmax(bad))]!r}) "
+                  f"kept as text in segment {self.next_segment}; add the format to LOG_TIME_FORMATS")
+        for j, name in enumerate(self.columns[1:], start=1):
+            arrays[name] = np.array([_to_float(row[j]) for row in rows], dtype=np.float64)
+
+        times = arrays['time'][~np.isnat(arrays['time'])]
+        t_min = str(times.min()) if len(times) else ''
+        t_max = str(times.max()) if len(times) else ''
+
+        segment = f'seg_{self.next_segment:06d}.npz'
+        path = os.path.join(self.directory, segment)
+        # Write under a temporary name so a crash never leaves a partial segment in the index
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, path)
+
+        with open(os.path.join(self.directory, INDEX_FILE), 'a', newline='') as index:
+            csv.writer(index).writerow([segment, t_min, t_max, len(rows)])
+        self.next_segment += 1
+
+def read_index(directory):
+    index_path = os.path.join(directory, INDEX_FILE)
+    if not os.path.isfile(index_path):
+        return []
+    with open(index_path, 'r') as index:
+        return list(csv.DictReader(index))
+
+def iter_segments(directory, start=None, end=None):
+    """
+    Yield one DataFrame per segment overlapping [start, end), rows outside the range removed
+    """
+    start = np.datetime64(pd.Timestamp(start), 'ms') if start is not None else None
+    end = np.datetime64(pd.Timestamp(end), 'ms') if end is not None else None
+
+    for entry in read_index(directory):
+        if not entry['t_min']:
+            print(f"Warning: segment {entry['segment']} has no readable times, skipped (see time_raw)")
+            continue
+        if end is not None and np.datetime64(entry['t_min'], 'ms') >= end:
+            continue
+        if start is not None and np.datetime64(entry['t_max'], 'ms') < start:
+            continue
+
+        with np.load(os.path.join(directory, entry['segment'])) as data:
+            times = data['time']
+            mask = ~np.isnat(times)
+            if not mask.all():
+                print(f"Warning: {(~mask).sum()} rows of {entry['segment']} have unrecognized times, skipped (see time_raw)")
+            if start is not None:
+                mask &= times >= start
+            if end is not None:
+                mask &= times < end
+            columns = {COMMODITY_COLUMNS[0]: data['time'][mask]}
+            for name in data.files:
+                if name not in ('time', 'time_raw'):
+                    columns[name] = data[name][mask]
+        yield pd.DataFrame(columns)
+
+def read_range(directory, start=None, end=None):
+    """
+    Load the commodity log rows with start <= time < end as one DataFrame
+    """
+    frames = list(iter_segments(directory, start, end))
+    if not frames:
+        return pd.DataFrame(columns=COMMODITY_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
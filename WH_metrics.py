@@ -0,0 +1,136 @@
+# Opt-in telemetry for the test rigs
+# Counters and latency histograms kept in memory and exposed either on a
+# local HTTP endpoint in Prometheus text format (http://<pi>:<port>/metrics)
+# or as a JSON file rewritten periodically. Nothing is started unless
+# start_metrics() is called, which the runners only do when METRICS_PORT or
+# METRICS_JSON is set.
+
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Default histogram buckets (seconds)
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60, 300, 600]
+
+_lock = threading.Lock()
+_metrics = {}
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=None):
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for key, value in self.values.items():
+            lines.append(f'{self.name}{_format_labels(key)} {value}')
+        return lines
+
+    def to_dict(self):
+        return {_format_labels(key) or 'total': value for key, value in self.values.items()}
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = sorted(buckets)
+        self.values = {}    # label key -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for key, (counts, total, count) in self.values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_format_labels(key, ("le", bound))} {bucket_count}')
+            lines.append(f'{self.name}_bucket{_format_labels(key, ("le", "+Inf"))} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+    def to_dict(self):
+        return {_format_labels(key) or 'total': {'count': count, 'sum': total,
+                                                   'mean': total / count if count else None,
+                                                   'buckets': dict(zip(self.buckets, counts))}
+                for key, (counts, total, count) in self.values.items()}
+
+def counter(name, help_text):
+    with _lock:
+        return _metrics.setdefault(name, Counter(name, help_text))
+
+def histogram(name, help_text, buckets=LATENCY_BUCKETS):
+    with _lock:
+        return _metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+def render_prometheus():
+    # Render under the lock so a new label added by inc()/observe() cannot change a dict mid-iteration
+    lines = []
+    with _lock:
+        for metric in _metrics.values():
+            lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def write_json(path):
+    with _lock:
+        snapshot = {name: metric.to_dict() for name, metric in _metrics.items()}
+    snapshot['updated'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f, indent=2)
+    os.replace(tmp_path, path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass    # keep the test output readable
+
+def start_metrics(port=None, json_file=None, interval=30):
+    """
+    Start the HTTP endpoint and/or the JSON writer in background threads
+    """
+    if port:
+        server = ThreadingHTTPServer(('0.0.0.0', port), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Metrics available at http://localhost:{port}/metrics")
+
+    if json_file:
+        def write_loop():
+            while True:
+                time.sleep(interval)
+                write_json(json_file)
+        threading.Thread(target=write_loop, daemon=True).start()
+        print(f"Metrics written to {json_file} every {interval} seconds")
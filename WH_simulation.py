@@ -0,0 +1,250 @@
+# Time-warp simulation of a test day
+# Runs WH_testing_1P.py / WH_testing_2P.py or DrawController_FM.py on a
+# virtual clock against stand-ins for sample2 and the GPIO hardware, so a
+# 24-hour schedule is replayed in seconds. Every command and draw is
+# recorded with its virtual timestamp together with its scheduling lag.
+#
+# Examples:
+#   python WH_simulation.py testing --runner 1P --schedule Testing_schedule_LSL.csv --hours 24
+#   python WH_simulation.py draws --schedule 12H-WDP.csv --hours 24
+
+import argparse
+import csv
+import importlib
+import os
+import shutil
+from datetime import datetime, timedelta
+
+from WH_clock import VirtualClock
+
+# Heater power (W) written to the simulated commodity log for each command
+MODE_POWER = {'e': 1000.0, 'l': 4500.0, 's': 0.0}
+LOG_INTERVAL = 60           # seconds between simulated commodity log rows
+FLOW_RATE_GPM = 2.0         # simulated flow through an open valve
+VALVE_CLOSE_LAG = 0.3       # seconds the simulated water keeps flowing after the valve is closed
+
+class FakeStdin:
+    def __init__(self, commodity):
+        self.commodity = commodity
+
+    def write(self, data):
+        for command in data.decode().split():
+            self.commodity.receive(command)
+
+    def flush(self):
+        pass
+
+class FakeCommodity:
+    """
+    Stand-in for the sample2 process: records commands and writes log.csv rows
+    """
+    def __init__(self, clock, log_file='log.csv'):
+        self.clock = clock
+        self.log_file = log_file
+        self.pid = None
+        self.stdin = FakeStdin(self)
+        self.mode = 'e'
+        self.commands = []
+        self.last_row = clock.now()
+        with open(log_file, 'w') as log:
+            log.write('Time,Power,Cumulative Energy,Energy Take Capacity,Total Energy Storage Capacity\n')
+        self.energy = 0.0
+
+    def write_log_rows(self):
+        rows = []
+        while self.last_row + timedelta(seconds=LOG_INTERVAL) <= self.clock.now():
+            self.last_row += timedelta(seconds=LOG_INTERVAL)
+            power = MODE_POWER[self.mode]
+            self.energy += power * LOG_INTERVAL / 3600
+            rows.append(f"{self.last_row:%Y-%m-%d %H:%M:%S},{power:.1f},{self.energy:.1f},0,0\n")
+        with open(self.log_file, 'a') as log:
+            log.writelines(rows)
+
+    def receive(self, command):
+        self.write_log_rows()
+        self.commands.append((self.clock.now(), command))
+        if command in MODE_POWER:
+            self.mode = command
+
+    def send_signal(self, sig):
+        self.write_log_rows()
+
+    def wait(self):
+        return 0
+
+class FakeGPIO:
+    """
+    Stand-in for RPi.GPIO: an open valve produces flow meter pulses as the virtual clock moves
+    """
+    BCM = 'BCM'
+    IN = 'IN'
+    OUT = 'OUT'
+    PUD_UP = 'PUD_UP'
+    RISING = 'RISING'
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self, clock, pulses_per_gal, flow_rate_gpm=FLOW_RATE_GPM, close_lag=VALVE_CLOSE_LAG):
+        self.clock = clock
+        self.pulse_rate = pulses_per_gal * flow_rate_gpm / 60   # pulses per second
+        self.close_lag = timedelta(seconds=close_lag)
+        self.closed_at = {}
+        self.valves = {}
+        self.callbacks = {}
+        self.fm_for_valve = {}
+        self.partial = {}
+        self.valve_events = []
+        clock.listeners.append(self.advance)
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        if direction == self.OUT:
+            self.valves[pin] = initial or self.LOW
+
+    def add_event_detect(self, pin, edge, callback=None):
+        self.callbacks[pin] = callback
+        # Pair each flow meter with the valve set up just before it
+        valve_pin = list(self.valves)[-1]
+        self.fm_for_valve[valve_pin] = pin
+        self.partial[pin] = 0.0
+
+    def output(self, pin, value):
+        if self.valves.get(pin) != value:
+            self.valve_events.append((self.clock.now(), pin, value))
+            if value == self.LOW:
+                self.closed_at[pin] = self.clock.now()
+        self.valves[pin] = value
+
+    def advance(self, old, new):
+        dt = (new - old).total_seconds()
+        for valve_pin, state in self.valves.items():
+            fm_pin = self.fm_for_valve.get(valve_pin)
+            if fm_pin is None:
+                continue
+            valve_dt = dt
+            if state != self.HIGH:
+                # Water still flows until the valve has finished closing
+                closed_at = self.closed_at.get(valve_pin)
+                if closed_at is None or old >= closed_at + self.close_lag:
+                    continue
+                valve_dt = (min(new, closed_at + self.close_lag) - old).total_seconds()
+            self.partial[fm_pin] += self.pulse_rate * valve_dt
+            while self.partial[fm_pin] >= 1:
+                self.partial[fm_pin] -= 1
+                self.callbacks[fm_pin](fm_pin)
+
+class InlineExecutor:
+    """
+    Runs submitted draws immediately, so only one thread moves the virtual clock
+    """
+    def submit(self, fn, *args):
+        fn(*args)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+def lag_minutes(sent, start):
+    return round((sent - start).total_seconds() / 60, 2)
+
+def simulate_testing(runner_name, schedule_file, hours, start, workdir):
+    runner = importlib.import_module(f'WH_testing_{runner_name}')
+    os.makedirs(workdir, exist_ok=True)
+    shutil.copy(schedule_file, os.path.join(workdir, 'Testing_schedule.csv'))
+    os.chdir(workdir)
+
+    clock = VirtualClock(start)
+    commodity = FakeCommodity(clock)
+    runner.clock = clock
+    runner.commodity_factory = lambda: commodity
+
+    timeline = runner.read_schedule()
+    schedule = runner.get_schedule(timeline)
+    summary = runner.CommoditySummary(runner.SUMMARY_PREFIX) if runner.SUMMARY_PREFIX else None
+    runner.start_test(hours, summary=summary, timeline=timeline)
+
+    with open('sim_commands.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['virtual_time', 'command'])
+        for sent, command in commodity.commands:
+            writer.writerow([sent.strftime('%Y-%m-%d %H:%M:%S'), command])
+
+    # Schedule lag: time from each scheduled start to the first matching command
+    print("\nSchedule lag:")
+    for item in schedule:
+        end = item['start'] + timedelta(minutes=item['duration'])
+        sent = [t for t, c in commodity.commands if c == item['command'] and item['start'] <= t < end]
+        if sent:
+            print(f"  {item['command']} at {item['start']:%H:%M}: sent {sent[0]:%H:%M:%S}, lag {lag_minutes(sent[0], item['start'])} min")
+        else:
+            print(f"  {item['command']} at {item['start']:%H:%M}: never sent")
+    print(f"{len(commodity.commands)} commands recorded in {os.path.join(workdir, 'sim_commands.csv')}")
+
+def simulate_draws(schedule_file, hours, start, workdir, control_mode=None):
+    controller = importlib.import_module('DrawController_FM')
+    if control_mode:
+        controller.CONTROL_MODE = control_mode
+    schedule_file = os.path.abspath(schedule_file)
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    clock = VirtualClock(start)
+    gpio = FakeGPIO(clock, controller.PULSES_PER_GAL)
+    controller.clock = clock
+    controller.GPIO = gpio
+    for rig in controller.RIGS:
+        rig['schedule'] = schedule_file
+
+    controller.main(until=start + timedelta(hours=hours), pool=InlineExecutor())
+
+    # Pair valve open/close events into draws and compare with the schedule
+    valve_names = {rig['valve_pin']: rig for rig in controller.RIGS}
+    opened = {}
+    with open('sim_draws.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['rig', 'scheduled', 'valve_open', 'valve_close', 'target_gal', 'start_latency_s'])
+        for event_time, pin, value in gpio.valve_events:
+            if value == gpio.HIGH:
+                opened[pin] = event_time
+                continue
+            rig = valve_names[pin]
+            open_time = opened.pop(pin)
+            # The scheduled second is the latest schedule entry at or before the valve opened
+            scheduled = None
+            for t in sorted(rig['draws']):
+                candidate = datetime.combine(open_time.date(), datetime.strptime(t, '%H:%M:%S').time())
+                if candidate <= open_time:
+                    scheduled = candidate
+            writer.writerow([rig['name'], f"{scheduled:%H:%M:%S}" if scheduled else '',
+                             f"{open_time:%H:%M:%S.%f}"[:-3], f"{event_time:%H:%M:%S.%f}"[:-3],
+                             rig['draws'].get(f"{scheduled:%H:%M:%S}", '') if scheduled else '',
+                             round((open_time - scheduled).total_seconds(), 3) if scheduled else ''])
+    print(f"{len(gpio.valve_events) // 2} draws recorded in {os.path.join(workdir, 'sim_draws.csv')}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a test day on a virtual clock')
+    parser.add_argument('mode', choices=['testing', 'draws'])
+    parser.add_argument('--runner', choices=['1P', '2P'], default='1P', help='WH_testing variant (testing mode)')
+    parser.add_argument('--schedule', required=True, help='testing schedule or draw schedule file')
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--start', default=None, help='virtual start time "YYYY-MM-DD HH:MM" (default: today 00:00)')
+    parser.add_argument('--workdir', default='sim_run', help='folder for the simulated logs')
+    parser.add_argument('--control', choices=['threshold', 'predictive'], help='valve control mode (draws mode)')
+    args = parser.parse_args()
+
+    if args.start:
+        start = datetime.strptime(args.start, '%Y-%m-%d %H:%M')
+    else:
+        start = datetime.combine(datetime.now().date(), datetime.min.time())
+
+    if args.mode == 'testing':
+        simulate_testing(args.runner, args.schedule, args.hours, start, args.workdir)
+    else:
+        simulate_draws(args.schedule, args.hours, start, args.workdir, args.control)
+
+if __name__ == "__main__":
+    main()
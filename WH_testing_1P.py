@@ -2,143 +2,287 @@
 # Work with Testing_schedule_LSL.py
 
 import subprocess
-import time
 import os
 import signal
 import csv
+import time
 from datetime import datetime, timedelta
+from WH_log_storage import ColumnarLog
+from WH_aggregator import CommoditySummary
+from Schedule_compile import load_schedule, ScheduleError
+from WH_checkpoint import save_checkpoint, load_checkpoint, clear_checkpoint
+from WH_clock import WallClock
+from WH_metrics import counter, histogram, start_metrics
+
+# Set to a folder name (e.g. 'output_store') to store the commodity log as
+# compressed column segments (see WH_log_storage.py) instead of output.csv
+LOG_STORAGE_DIR = None
+
+# Per-minute/per-hour summaries of the copied rows (see WH_aggregator.py),
+# written to <prefix>_minute.csv and <prefix>_hour.csv; None to turn off
+SUMMARY_PREFIX = 'WH_summary'
+
+# Time source and sample2 launcher; WH_simulation.py replaces these with a
+# virtual clock and a stand-in for sample2
+clock = WallClock()
+commodity_factory = None
+
+# Opt-in telemetry (see WH_metrics.py): a port for the /metrics endpoint
+# and/or a JSON file rewritten every 30 seconds
+METRICS_PORT = None
+METRICS_JSON = None
+
+commands_sent = counter('wh_commands_sent_total', 'Commands sent to sample2')
+command_dispatch = histogram('wh_command_dispatch_seconds', 'Time to write a command to sample2')
+loop_lag = histogram('wh_loop_lag_seconds', 'Delay of each control cycle behind its planned start')
+schedule_lag = histogram('wh_schedule_lag_seconds', 'Delay from a scheduled period start to its first command')
+log_copy = histogram('wh_log_copy_seconds', 'Time to copy new log.csv rows to the output')
+log_rows = counter('wh_log_rows_copied_total', 'Rows copied from log.csv')
 
 def start_commodity():
     global process
-    process = subprocess.Popen(['./sample2'], stdin=subprocess.PIPE)
-    time.sleep(5)
+    if commodity_factory is not None:
+        process = commodity_factory()
+    else:
+        process = subprocess.Popen(['./sample2'], stdin=subprocess.PIPE)
+    clock.sleep(5)
     send_command('o\n')  # Initial outside communication
 
 def send_command(command):
+    dispatch_start = time.perf_counter()
     process.stdin.write(command.encode())
     process.stdin.flush()
-    time.sleep(1)
-
-def update_csv(input_file, output_file, last_line):
-    with open(input_file, 'r') as input_csv, open(output_file, 'a') as output_csv:
-        reader = csv.reader((row.replace('\0','') for row in input_csv), delimiter=',')
-        writer = csv.writer(output_csv)
-        for i, row in enumerate(reader):
-            if i > last_line:
-                writer.writerow(row)
-                last_line = i
-    return last_line
+    command_dispatch.observe(time.perf_counter() - dispatch_start)
+    commands_sent.inc(command=command.strip())
+    clock.sleep(1)
+
+def read_log_rows(input_file, offset, end_offset=None):
+    """
+    Rows of the complete lines of input_file from byte `offset` (up to `end_offset`)
+    and the offset after them. The first line of input_file (offset 0) is skipped.
+    """
+    with open(input_file, 'rb') as input_csv:
+        input_csv.seek(offset)
+        data = input_csv.read() if end_offset is None else input_csv.read(max(end_offset - offset, 0))
+    end = data.rfind(b'\n') + 1    # leave a partially written last line for the next copy
+    lines = data[:end].replace(b'\0', b'').decode(errors='replace').splitlines()
+    if offset == 0:
+        lines = lines[1:]
+    return [row for row in csv.reader(lines, delimiter=',')], offset + end
+
+def update_csv(input_file, output_file, offset, storage=None, summary=None, command=None):
+    """
+    Copy the complete lines of input_file past byte `offset` and return the new offset.
+    The first line of input_file (offset 0) is skipped. The copied rows are also
+    added to `summary` with the command in effect.
+    """
+    copy_start = time.perf_counter()
+    if os.path.getsize(input_file) < offset:
+        print("log.csv is shorter than the last copied position, copying from the start")
+        offset = 0
+
+    new_rows, new_offset = read_log_rows(input_file, offset)
+    if storage is not None:
+        storage.append_rows(new_rows, offset)
+    else:
+        with open(output_file, 'a') as output_csv:
+            csv.writer(output_csv).writerows(new_rows)
+    if summary is not None:
+        summary.add_rows(new_rows, command)
+
+    log_rows.inc(len(new_rows))
+    log_copy.observe(time.perf_counter() - copy_start)
+    return new_offset
 
 def end_service():
-    os.kill(process.pid, signal.SIGINT)
+    process.send_signal(signal.SIGINT)
     process.wait()
-    time.sleep(5)
+    clock.sleep(5)
 
-def get_schedule():
-    schedule = []
+def read_schedule():
+    """
+    Compiled Testing_schedule.csv (see Schedule_compile.py), None if it is missing or invalid
+    """
     try:
-        with open('Testing_schedule.csv', 'r') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                current_date = datetime.now().date()
-                
-                # Load-up command
-                if row['LU_time'] and row['LU_duration']:
-                    lu_time = datetime.combine(current_date, datetime.strptime(row['LU_time'], '%H:%M').time())
-                    schedule.append({
-                        'command': 'l',
-                        'start': lu_time,
-                        'duration': float(row['LU_duration']) * 60  # Convert hours to minutes
-                    })
-                
-                # Shed command
-                if row['S_time'] and row['S_duration']:
-                    s_time = datetime.combine(current_date, datetime.strptime(row['S_time'], '%H:%M').time())
-                    schedule.append({
-                        'command': 's',
-                        'start': s_time,
-                        'duration': float(row['S_duration']) * 60  # Convert hours to minutes
-                    })
-                
-                # Recovery Load-up command
-                if row['RLU_time'] and row['RLU_duration']:
-                    rlu_time = datetime.combine(current_date, datetime.strptime(row['RLU_time'], '%H:%M').time())
-                    schedule.append({
-                        'command': 'l',  # Assuming recovery load-up uses the same command as initial load-up
-                        'start': rlu_time,
-                        'duration': float(row['RLU_duration']) * 60  # Convert hours to minutes
-                    })
-        
-        schedule.sort(key=lambda x: x['start'])
-        
-        for i in range(1, len(schedule)):
-            if schedule[i]['start'] < schedule[i-1]['start']:
-                schedule[i]['start'] += timedelta(days=1)
-        
-        return schedule
+        return load_schedule('Testing_schedule.csv')
     except FileNotFoundError:
         print("Error: 'Testing_schedule.csv' not found in the current directory.")
-        return []
+    except ScheduleError as e:
+        print("Error: invalid schedule, fix Testing_schedule.csv before starting the test:")
+        for error in e.errors:
+            print(f"  {error}")
     except Exception as e:
         print(f"Error reading schedule: {e}")
+    return None
+
+def get_schedule(timeline=None):
+    """
+    Schedule items for today from a compiled timeline (read from Testing_schedule.csv if not given)
+    """
+    if timeline is None:
+        timeline = read_schedule()
+    if timeline is None:
         return []
 
+    midnight = datetime.combine(clock.now().date(), datetime.min.time())
+    periods = timeline['periods']
+    # A schedule starting the evening before its day (e.g. a 23:00 morning load-up),
+    # started on that evening, is for tomorrow
+    if periods and periods[0]['start'] < 0 and midnight + timedelta(seconds=periods[-1]['end']) <= clock.now():
+        midnight += timedelta(days=1)
+    return [{
+        'command': p['command'],
+        'start': midnight + timedelta(seconds=p['start']),
+        'duration': (p['end'] - p['start']) / 60   # minutes
+    } for p in periods]
+
+def output_position(storage):
+    if storage is not None:
+        # Segments written, and the log.csv offset of the rows still buffered in memory
+        return [storage.next_segment, storage.buffer_start]
+    return os.path.getsize('output.csv') if os.path.isfile('output.csv') else 0
+
+def restore_output(storage, position, log_offset):
+    """
+    Drop output written after the checkpoint so resumed copies are not duplicated,
+    and buffer again the rows that were not in a segment yet
+    """
+    if storage is not None:
+        segments, buffer_start = position if isinstance(position, list) else (position, None)
+        storage.rollback(segments)
+        if buffer_start is not None:
+            rows, _ = read_log_rows('log.csv', buffer_start, log_offset)
+            storage.append_rows(rows, buffer_start)
+    elif os.path.isfile('output.csv'):
+        with open('output.csv', 'r+b') as output_csv:
+            output_csv.truncate(position)
+
 def main():
+    if METRICS_PORT or METRICS_JSON:
+        start_metrics(METRICS_PORT, METRICS_JSON)
+
+    storage = ColumnarLog(LOG_STORAGE_DIR) if LOG_STORAGE_DIR else None
+    summary = CommoditySummary(SUMMARY_PREFIX) if SUMMARY_PREFIX else None
+
+    checkpoint = load_checkpoint()
+    if checkpoint and checkpoint['end_time'] > clock.now():
+        print(f"Found checkpoint saved at {checkpoint['saved_at']}, test ends at {checkpoint['end_time']:%Y-%m-%d %H:%M}")
+        if input("Resume previous test? (y/n): ").lower() == 'y':
+            resume_test(checkpoint, storage, summary)
+            return
+    clear_checkpoint()
+
+    # Validate the schedule before waiting for the start time or starting sample2
+    timeline = read_schedule()
+    if timeline is None:
+        print("No valid schedule found. Exiting.")
+        return
+
     test_duration = int(input("How long should the test run? (hours): "))
     
     start_choice = input("Start immediately? (y/n): ").lower()
     if start_choice != 'y':
         start_time = input("Enter start time (HH:MM): ")
         hour, minute = map(int, start_time.split(':'))
-        start_datetime = datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0)
-        if start_datetime <= datetime.now():
+        start_datetime = clock.now().replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if start_datetime <= clock.now():
             start_datetime += timedelta(days=1)
-        wait_time = (start_datetime - datetime.now()).total_seconds()
+        wait_time = (start_datetime - clock.now()).total_seconds()
         print(f"Waiting for {wait_time/3600:.2f} hours to start...")
-        time.sleep(wait_time)
+        clock.sleep(wait_time)
 
-    print("Starting commodity service...")
-    start_commodity()
+    start_test(test_duration, storage, summary, timeline)
 
-    schedule = get_schedule()
+def start_test(test_duration, storage=None, summary=None, timeline=None):
+    # Items are dated when the test starts, after any wait for the start time
+    schedule = get_schedule(timeline)
     if not schedule:
         print("No valid schedule found. Exiting.")
-        end_service()
         return
 
+    print("Starting commodity service...")
+    start_commodity()
+
     last_event_time = max(item['start'] + timedelta(minutes=item['duration']) for item in schedule)
-    end_time = max(datetime.now() + timedelta(hours=test_duration), last_event_time)
+    end_time = max(clock.now() + timedelta(hours=test_duration), last_event_time)
+
+    state = {
+        'log_offset': 0,
+        'output_position': output_position(storage),
+        'schedule': schedule,
+        'end_time': end_time,
+        'last_command': None,
+        'summary': summary.state() if summary is not None else None,
+    }
+    save_checkpoint(state)
+    run_test(state, storage, summary)
+
+def resume_test(state, storage, summary=None):
+    print("Resuming test from checkpoint...")
+    restore_output(storage, state['output_position'], state['log_offset'])
+    if summary is not None:
+        summary.restore(state.get('summary'))
+
+    print("Starting commodity service...")
+    start_commodity()
+    if state['last_command']:
+        print(f"Last command sent before the restart: {state['last_command']}")
+    run_test(state, storage, summary)
+
+def run_test(state, storage, summary=None):
+    schedule = state['schedule']
+    end_time = state['end_time']
 
-    last_line = 0
+    planned_time = None
+    started = set()
 
     print("Beginning test execution...")
-    while datetime.now() < end_time:
-        current_time = datetime.now()
+    while clock.now() < end_time:
+        current_time = clock.now()
+        if planned_time is not None:
+            loop_lag.observe(max((current_time - planned_time).total_seconds(), 0))
         
         active_command = None
-        for item in schedule:
+        for i, item in enumerate(schedule):
             if item['start'] <= current_time < item['start'] + timedelta(minutes=item['duration']):
+                if i not in started:
+                    started.add(i)
+                    schedule_lag.observe((current_time - item['start']).total_seconds())
                 active_command = item['command']
                 send_command(f"{active_command}\n")
                 print(f"Sent command: {active_command}")
                 break
         
         if not active_command:
+            active_command = 'e'
             send_command("e\n")  # Baseline if no other command is active
             print("Sent command: Baseline")
 
         send_command("o\n")
         print("Sent outside communication command")
 
-        last_line = update_csv('log.csv', 'output.csv', last_line)
+        # The rows copied now were logged under the command of the previous cycle
+        state['log_offset'] = update_csv('log.csv', 'output.csv', state['log_offset'], storage,
+                                         summary, state['last_command'])
+        state['output_position'] = output_position(storage)
+        state['last_command'] = active_command
+        if summary is not None:
+            state['summary'] = summary.state()
+        save_checkpoint(state)
 
         next_interval = current_time + timedelta(minutes=10)
-        sleep_time = (next_interval - datetime.now()).total_seconds()
+        planned_time = next_interval
+        sleep_time = (next_interval - clock.now()).total_seconds()
         if sleep_time > 0:
             print(f"Sleeping for {sleep_time/60:.2f} minutes...")
-            time.sleep(sleep_time)
+            clock.sleep(sleep_time)
 
     end_service()
+    if storage is not None:
+        storage.flush()
+    if summary is not None:
+        summary.close()
+    clear_checkpoint()
     print("Test completed.")
 
 if __name__ == "__main__":